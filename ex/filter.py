@@ -0,0 +1,12 @@
+__doc__ = '''"spa.movie.add_filter" Example'''
+
+base_image = spa.load('test4.png', spa.imtype.test)
+out_image = PIL.Image.new('RGBA', base_image.size, color=spa.colorize('white'))
+
+movie = spa.movie(out_image)
+movie.add_sequence(lambda pf, **k: spa.fx.still(base_image, **k), 0.1)
+movie.add_sequence(lambda pf, nf, **k: spa.fx.fade(pf, nf,
+    fade_color=spa.colorize('white'), **k), 2.0)
+movie.add_filter(lambda f: f.convert('LA').convert('RGBA'), (0.0, 1.0), is_timed=True)
+movie.add_filter(lambda fs: PIL.Image.blend(fs[0], fs[-1], 0.5), (0.5, 1.0), radius=2)
+movie.add_sequence(lambda pf, **k: spa.fx.still(base_image, **k), 0.1)
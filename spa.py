@@ -2,19 +2,20 @@
 
 __doc__ = '''Module for "SPA" Console Application'''
 
-import os, sys, math, argparse, logging, subprocess
+import os, sys, re, glob, math, time, argparse, logging, traceback, subprocess, multiprocessing
+import StringIO
 import spa
 from PIL import Image
 
-### Main Entry Point ###
+### Module Constants ###
 
-def main():
-    # Script Setup #
+encoding_map = {
+    'mp4': spa.ffmpeg.encoding.mp4,
+    'gif': spa.ffmpeg.encoding.gif }
 
-    encoding_map = {
-        'mp4': spa.ffmpeg.encoding.mp4,
-        'gif': spa.ffmpeg.encoding.gif }
+### Main Entry Point ###
 
+def main():
     # Argument Parsing #
 
     parser = argparse.ArgumentParser(description=
@@ -32,6 +33,29 @@ def main():
         help='The level of quality present in the result movie. This '
         'argument defaults to the highest available quality value.')
 
+    parser.add_argument('--profile', dest='profile', nargs='?',
+        type=str,
+        default='default',
+        choices=sorted(spa.ffmpeg.profiles.keys()),
+        help='The encoder profile (i.e. codec, preset, thread count and pixel '
+        'format) used to encode the movie, which defaults to "default". The '
+        '"lossless-fast" profile is meant for intermediate movies, "archival" '
+        'for long-term storage and "web" for distribution.')
+    parser.add_argument('--bench-encoders', dest='bench_encoders', action='store_true',
+        default=False,
+        help='If specified, this flag indicates that the script should encode '
+        'the frames of the input file (or "ex/fade.py" if none is given) with '
+        'each encoder profile and report the time, throughput and output size '
+        'of each encoding instead of rendering a movie.')
+    parser.add_argument('--bench-strokes', dest='bench_strokes', action='store_true',
+        default=False,
+        help='If specified, this flag indicates that the script should compare '
+        'the time taken by the original (depth-first) and current (Moore '
+        'neighbour) stroke tracers on each test cell image (i.e. '
+        '"in/tests/*_cells.png") instead of rendering a movie. Only the '
+        'tracers are timed; both are given cells and boundaries from the '
+        'current analysis functions.')
+
     parser.add_argument('-e', '--encoding', dest='encoding', nargs='?',
         type=str,
         default='mp4',
@@ -39,30 +63,135 @@ def main():
         help='The type of encoding that will be used for the generated movie. '
         'The default encoding type is "mp4".')
     parser.add_argument('-o', '--output', dest='output', nargs='?',
-        type=argparse.FileType('w+'),
-        default=os.path.join(os.getcwd(), 'output.mp4'),
+        type=str,
+        default=None,
         help='The path to the output file for the generated movie. By default, '
         'this path will be set to be a file named "output.mp4" in the current '
-        'working directory.')
+        'working directory. In batch mode, this is instead the path to the '
+        'directory that will contain the movies, which are named after their '
+        'input files and default to the current working directory.')
     parser.add_argument('-d', '--outdir', dest='outdir', nargs='?',
         type=str,
         default='',
         help='The path to the output directory that contains all of the '
         'temporary/intermediate files generated for the movie. This argument '
         'is generally only specified when generating large movie files. '
-        'By default, this value is set to "spa/output/(output_name)".')
+        'By default, this value is set to "spa/output/(output_name)". In batch '
+        'mode, the files for each movie are placed in a subdirectory named '
+        'after its input file.')
+    parser.add_argument('-b', '--batch', dest='batch', action='store_true',
+        default=False,
+        help='If specified, this flag indicates that all of the given input '
+        'files should be rendered together in a single process, sharing worker '
+        'processes, decoded images and analysis results between them.')
+
+    parser.add_argument('-p', '--preview', dest='preview', nargs='?',
+        type=float,
+        const=0.5,
+        default=None,
+        help='If specified, the movie is rendered as a quick draft with its '
+        'frames scaled by the given factor (0.5 if no factor is given), '
+        'nearest neighbor resampling and a fast encoding. Loaded images are '
+        'never scaled, so scenes and their image analyses are unaffected.')
+    parser.add_argument('--preview-fps', dest='preview_fps', nargs='?',
+        type=int,
+        default=24,
+        help='The maximum framerate (in frames per second) of preview movies, '
+        'which defaults to 24.')
+
+    parser.add_argument('-r', '--range', dest='span', nargs='?',
+        type=_parse_span,
+        default=None,
+        help='The span of time (in seconds) of the movie to render, which is '
+        'given as "start-end" (e.g. "5.5-7.0"). Only the sequences that overlap '
+        'this span are rendered, and the output is a clip of just this span. '
+        'By default, the whole movie is rendered.')
+    parser.add_argument('--sequences', dest='sequences', nargs='?',
+        type=_parse_sequences,
+        default=None,
+        help='The comma-separated list of the sequences of the movie to render '
+        '(e.g. "3,4"), which are numbered starting from 1. By default, all of '
+        'the sequences in the movie are rendered.')
+
+    parser.add_argument('-w', '--watch', dest='watch', action='store_true',
+        default=False,
+        help='If specified, this flag indicates that the script should keep '
+        'running after the movie is rendered and render it again whenever the '
+        'input file or any of the images it loads are changed.')
+    parser.add_argument('--watch-interval', dest='watch_interval', nargs='?',
+        type=float,
+        default=0.5,
+        help='The interval (in seconds) at which watched files are checked '
+        'for changes, which defaults to 0.5 seconds.')
+
+    parser.add_argument('--daemon', dest='daemon', nargs='?',
+        type=str,
+        default=None,
+        help='The path to a UNIX socket on which to run a render daemon, which '
+        'accepts render jobs given as the arguments to this script and renders '
+        'them in a warm process. If specified, no input files are rendered '
+        'directly and all other arguments are ignored.')
+    parser.add_argument('--max-jobs', dest='max_jobs', nargs='?',
+        type=int,
+        default=1,
+        help='The maximum number of jobs rendered at once by the render '
+        'daemon, which defaults to 1.')
+
+    parser.add_argument('-j', '--jobs', dest='jobs', nargs='?',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='The number of worker processes used to render independent '
+        'sequences in parallel, which defaults to the number of available '
+        'CPU cores.')
+    parser.add_argument('-s', '--stream', dest='stream', action='store_true',
+        default=False,
+        help='If specified, this flag indicates that frames should be streamed '
+        'directly into "ffmpeg" as they are generated instead of being saved '
+        'as intermediate image files, which reduces memory and disk usage. '
+        'Streams are encoded at a constant frame rate, so held frames are '
+        'repeated in the stream rather than stored once as they are with '
+        'image files.')
+
+    parser.add_argument('-t', '--threads', dest='threads', nargs='?',
+        type=int,
+        default=None,
+        help='The number of threads used by each worker process to apply '
+        'the filters of the sequence it renders, which defaults to the number '
+        'of available CPUs divided among the worker processes (at least 1).')
+    parser.add_argument('-m', '--memory', dest='memory', nargs='?',
+        type=int,
+        default=1024,
+        help='The maximum amount of memory (in megabytes) used to hold the '
+        'frames of each sequence, past which frames are spilled to disk. '
+        'This argument defaults to 1024 megabytes.')
+
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+        default=True,
+        help='If specified, this flag indicates that all sequences should be '
+        'rendered from scratch instead of reusing the unchanged sequences '
+        'stored in the render cache.')
+    parser.add_argument('--clear-cache', dest='clear_cache', action='store_true',
+        default=False,
+        help='If specified, this flag indicates that the render and analysis '
+        'caches should be emptied before the movie is rendered.')
+    parser.add_argument('--cache-size', dest='cache_size', nargs='?',
+        type=int,
+        default=1024,
+        help='The maximum size (in megabytes) of the render cache, whose least '
+        'recently used sequences are evicted past this size. This argument '
+        'defaults to 1024 megabytes.')
 
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
         default=False,
         help='If specified, this flag indicates that the script should '
         'generate verbose program output.')
 
-    parser.add_argument('input',
+    parser.add_argument('input', nargs='*',
         type=argparse.FileType('r'),
         help='The path to the input file used to generate this movie. This '
         'file should contain a Python script that produces a "spa.movie" '
         'object called "movie", which this script will use to generate the '
-        'output.')
+        'output. Multiple input files can only be given in batch mode.')
 
     # Argument Handling #
 
@@ -72,48 +201,266 @@ def main():
         level=logging.DEBUG if spa_run.verbose else logging.WARNING)
     logging.getLogger('PIL').setLevel(logging.CRITICAL)
 
-    spa_run.input.close()
-    spa_run.input = os.path.realpath(spa_run.input.name)
-    spa_run.output.close()
-    spa_run.output = os.path.realpath(spa_run.output.name)
+    if spa_run.daemon is not None:
+        spa_daemon = spa.daemon(spa_run.daemon,
+            lambda job_args: _prepare_job(parser, job_args), max_jobs=spa_run.max_jobs)
+        try:
+            spa_daemon.serve()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if spa_run.bench_strokes:
+        return 0 if _bench_strokes(spa_run) else 1
+
+    if spa_run.bench_encoders and not spa_run.input:
+        spa_run.input = [open(os.path.join(spa.base_dir, 'ex', 'fade.py'), 'r')]
+    _setup_run(parser, spa_run)
 
     # Script Behavior #
 
+    if spa_run.bench_encoders:
+        return 0 if _bench_encoders(spa_run) else 1
+
+    render_cache = spa.rcache(max_size=spa_run.cache_size * 2**20)
+    if spa_run.clear_cache: render_cache.clear(); spa.acache().clear()
+
+    if not spa_run.watch:
+        return 0 if _render_inputs(spa_run, render_cache) else 1
+
+    # NOTE(JRC): In watch mode, the input files are executed again whenever
+    # they or any of the files they load change. Only the sequences affected by
+    # the changes are rendered again since all others are served from the cache.
+    try:
+        while True:
+            watch_mtimes = _get_mtimes(spa_run.input)
+            spa.loaded_paths.clear()
+            try:
+                _render_inputs(spa_run, render_cache)
+            except Exception:
+                spa.log.error(traceback.format_exc())
+            watch_mtimes.update(spa.loaded_paths)
+
+            spa.log.warning(('Watching SPA execution file(s) "{0}" and {1} loaded '
+                'file(s) for changes.').format('", "'.join(spa_run.input),
+                len(spa.loaded_paths)))
+            while _get_mtimes(watch_mtimes.keys()) == watch_mtimes:
+                time.sleep(spa_run.watch_interval)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+### Helper Functions ###
+
+def _setup_run(parser, spa_run):
+    if not spa_run.input:
+        parser.error('at least one input file must be given')
+    if not spa_run.batch and len(spa_run.input) > 1:
+        parser.error('multiple input files can only be rendered in batch mode')
+
+    for input_file in spa_run.input: input_file.close()
+    spa_run.input = [os.path.realpath(i.name) for i in spa_run.input]
+    spa_run.output = os.path.realpath(spa_run.output or
+        (os.getcwd() if spa_run.batch else os.path.join(os.getcwd(), 'output.mp4')))
+    spa_run.extension = spa_run.encoding
+    if spa_run.threads is None:
+        spa_run.threads = max(1, multiprocessing.cpu_count() // max(spa_run.jobs or 1, 1))
+    spa_run.encoding = encoding_map[spa_run.encoding]
+
+    # NOTE(JRC): These settings are always assigned in full since a daemon
+    # process sets them up again for every job that it renders.
+    spa.fstore.default_size = spa_run.memory * 2**20
+    spa.preview.update({'enabled': spa_run.preview is not None,
+        'scale': spa_run.preview or 1.0, 'fps': spa_run.preview_fps})
+
+def _prepare_job(parser, job_args):
+    # NOTE(JRC): The input files of each job are executed in the daemon
+    # process so that the images they load stay decoded for later jobs; only
+    # the movies are rendered in the job's process.
+    # NOTE(JRC): The parser reports invalid arguments by printing them, so its
+    # output is captured and sent back to the client instead of being printed
+    # by the daemon.
+    parser_stdout, parser_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = parser_output = StringIO.StringIO()
+    try:
+        job_run = parser.parse_args(job_args)
+        _setup_run(parser, job_run)
+    except SystemExit:
+        raise ValueError('Invalid render job arguments "{0}".\n{1}'.format(
+            ' '.join(job_args), parser_output.getvalue().strip()))
+    finally:
+        sys.stdout, sys.stderr = parser_stdout, parser_stderr
+    if job_run.watch or job_run.daemon is not None:
+        raise ValueError('Render jobs cannot watch files or run daemons.')
+
+    render_cache = spa.rcache(max_size=job_run.cache_size * 2**20)
+    if job_run.clear_cache: render_cache.clear(); spa.acache().clear()
+
+    job_renders = _load_inputs(job_run)
+    return lambda progress: _render_movies(job_run, job_renders, render_cache, progress)
+
+def _render_inputs(spa_run, render_cache):
+    return _render_movies(spa_run, _load_inputs(spa_run), render_cache)
+
+def _load_inputs(spa_run):
+    # NOTE(JRC): A failure in one of the input files of a batch only prevents
+    # the movie for that file from being rendered.
+    renders = []
+    for input_path in spa_run.input:
+        try:
+            input_movie = _load_input(input_path)
+        except Exception:
+            if not spa_run.batch: raise
+            spa.log.error(traceback.format_exc())
+            continue
+
+        output_name = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = spa_run.output if not spa_run.batch else \
+            os.path.join(spa_run.output, '{0}.{1}'.format(output_name, spa_run.extension))
+        data_path = spa_run.outdir if not (spa_run.batch and spa_run.outdir) else \
+            os.path.join(spa_run.outdir, output_name)
+
+        renders.append((input_movie, output_path, {
+            'data_path': data_path,
+            'fps': spa_run.fps, 'quality': spa_run.quality,
+            'encoding': spa_run.encoding,
+            'stream': spa_run.stream, 'threads': spa_run.threads,
+            'span': spa_run.span, 'sequences': spa_run.sequences,
+            'profile': spa_run.profile,
+            'preview': spa_run.preview, 'preview_fps': spa_run.preview_fps }))
+
+    return renders
+
+def _render_movies(spa_run, renders, render_cache, progress=None):
+    try:
+        render_results = spa.movie.render_batch(renders, workers=spa_run.jobs,
+            cache=render_cache if spa_run.cache else None, progress=progress)
+    except subprocess.CalledProcessError:
+        spa.log.error(('Error processing SPA execution file(s) "{0}"; '
+            'the target movie failed to render with "ffmpeg"; '
+            'synopsis below.').format('", "'.join(spa_run.input)))
+        raise
+    except Exception:
+        spa.log.error(('Error processing SPA execution file(s) "{0}"; '
+            'the "spa.movie.render" function encountered errors; '
+            'synopsis below.').format('", "'.join(spa_run.input)))
+        raise
+
+    return len(renders) == len(spa_run.input) and all(render_results)
+
+def _bench_encoders(spa_run):
+    # NOTE(JRC): The reference frames are rendered once as a lossless movie
+    # and extracted to images so that each profile is timed on its encoding
+    # alone rather than on the generation of the frames.
+    bench_path = os.path.join(spa.temp_dir, 'bench')
+    if not spa.touch(bench_path, is_dir=True, force=True): return False
+
+    bench_run = argparse.Namespace(**vars(spa_run))
+    bench_run.batch, bench_run.cache, bench_run.profile = False, False, 'lossless-fast'
+    bench_run.encoding, bench_run.extension = spa.ffmpeg.encoding.mp4, 'mp4'
+    bench_run.output = os.path.join(bench_path, 'reference.mp4')
+    bench_run.outdir = os.path.join(bench_path, 'reference')
+    if not _render_movies(bench_run, _load_inputs(bench_run), None): return False
+
+    bench_tmpl = os.path.join(bench_path, 'frame-%d.png')
+    subprocess.check_output(['ffmpeg', '-i', bench_run.output, '-r', str(spa_run.fps),
+        '-start_number', '0', '-y', bench_tmpl], stderr=subprocess.STDOUT)
+    bench_frames = len([p for p in os.listdir(bench_path) if p.startswith('frame-')])
+
+    print('{0:<16}{1:>12}{2:>12}{3:>14}'.format('profile', 'time (s)', 'fps', 'size (KB)'))
+    for profile in sorted(spa.ffmpeg.profiles.keys()):
+        profile_path = os.path.join(bench_path, '{0}.mp4'.format(profile))
+
+        profile_start = time.time()
+        spa.ffmpeg.render(profile_path, bench_tmpl, fps=spa_run.fps,
+            quality=spa_run.quality, profile=profile)
+        profile_time = time.time() - profile_start
+
+        print('{0:<16}{1:>12.3f}{2:>12.1f}{3:>14.1f}'.format(profile, profile_time,
+            bench_frames / profile_time, os.path.getsize(profile_path) / 1024.0))
+
+    return True
+
+def _bench_strokes(spa_run):
+    # NOTE(JRC): This only compares the stroke tracers, which are both given
+    # the cells and boundaries of the current analysis functions (i.e. it
+    # doesn't measure the original analysis pipeline end to end). The original
+    # tracer requires the pixels of each boundary to be listed in the traversal
+    # order of the connected components search, so the boundaries are
+    # reordered (untimed) before it's run.
+    test_paths = sorted(glob.glob(os.path.join(spa.test_dir, '*_cells.png')))
+    if not test_paths: return False
+
+    print('Stroke tracer times (cells and boundaries are precomputed and untimed)')
+    print('{0:<20}{1:>12}{2:>16}{3:>16}{4:>10}'.format(
+        'image', 'boundary', 'dfs trace (s)', 'moore trace (s)', 'speedup'))
+    for test_path in test_paths:
+        test_image = spa.load(os.path.basename(test_path), spa.imtype.test)
+        test_boundaries = spa.imp.calc_cell_boundaries(test_image,
+            spa.imp.calc_opaque_cells(test_image))
+        test_orders = [[spa.imp.calc_connected_components(test_image, set(b),
+            lambda *a: True)[0] for b in bl] for bl in test_boundaries]
+
+        bench_times = []
+        for bench_func, bench_boundaries in [
+                (spa.imp._calc_cell_strokes_dfs, test_orders),
+                (spa.imp.calc_cell_strokes, test_boundaries)]:
+            bench_start = time.time()
+            try:
+                bench_func(test_image, bench_boundaries)
+                bench_times.append(time.time() - bench_start)
+            except RuntimeError:
+                bench_times.append(None)
+
+        print('{0:<20}{1:>12}{2:>16}{3:>16.3f}{4:>10}'.format(
+            os.path.basename(test_path), sum(len(b) for bl in test_boundaries for b in bl),
+            'failed' if bench_times[0] is None else '{0:.3f}'.format(bench_times[0]),
+            bench_times[1], 'n/a' if bench_times[0] is None else
+            '{0:.1f}x'.format(bench_times[0] / max(bench_times[1], 1e-6))))
+
+    return True
+
+def _load_input(input_path):
     try:
         input_vars = {
-            '__file__': os.path.realpath(spa_run.input),
+            '__file__': input_path,
             'PIL': sys.modules['PIL'],
             'spa': sys.modules['spa'],
         }
-        execfile(spa_run.input, input_vars)
+        execfile(input_path, input_vars)
     except Exception:
         spa.log.error(('Error in SPA execution file "{0}"; '
-            'synopsis below.').format(spa_run.input))
+            'synopsis below.').format(input_path))
         raise
     if 'movie' not in input_vars:
         raise ValueError(('Error in SPA execution file "{0}"; '
-            'file fails to define a "movie" variable.').format(spa_run.input))
+            'file fails to define a "movie" variable.').format(input_path))
     if not isinstance(input_vars.get('movie', False), spa.movie):
         raise ValueError(('Error in SPA execution file "{0}"; '
-            'file defines "movie" variable as non-"spa.movie" type.').format(spa_run.input))
+            'file defines "movie" variable as non-"spa.movie" type.').format(input_path))
 
-    try:
-        input_vars['movie'].render(
-            spa_run.output, data_path=spa_run.outdir,
-            fps=spa_run.fps, quality=spa_run.quality,
-            encoding=encoding_map[spa_run.encoding] )
-    except subprocess.CalledProcessError:
-        spa.log.error(('Error processing SPA execution file "{0}"; '
-            'the target movie failed to render with "ffmpeg"; '
-            'synopsis below.').format(spa_run.input))
-        raise
-    except Exception:
-        spa.log.error(('Error processing SPA execution file "{0}"; '
-            'the "spa.movie.render" function encountered errors; '
-            'synopsis below.').format(spa_run.input))
-        raise
+    return input_vars['movie']
 
-    return 0
+def _get_mtimes(paths):
+    return {p: os.path.getmtime(p) if os.path.exists(p) else None for p in paths}
+
+def _parse_span(span_str):
+    span_match = re.match(r'^\s*(\d*\.?\d+)\s*-\s*(\d*\.?\d+)\s*$', span_str)
+    if not span_match or float(span_match.group(1)) >= float(span_match.group(2)):
+        raise argparse.ArgumentTypeError(('Invalid time range "{0}"; range must '
+            'be of the form "start-end" with start < end.').format(span_str))
+    return (float(span_match.group(1)), float(span_match.group(2)))
+
+def _parse_sequences(seqs_str):
+    try:
+        seq_indices = [int(s) - 1 for s in seqs_str.split(',')]
+    except ValueError:
+        seq_indices = [-1]
+    if any(si < 0 for si in seq_indices):
+        raise argparse.ArgumentTypeError(('Invalid sequence list "{0}"; list must '
+            'contain sequence numbers starting from 1.').format(seqs_str))
+    return seq_indices
 
 ### Miscellaneous ###
 
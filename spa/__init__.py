@@ -3,5 +3,14 @@ from spa import *
 from movie import movie
 from vector import vector
 from bezier import bezier
+from rcache import rcache
+from acache import acache
+from fstore import fstore
+from daemon import daemon
+from pxgrid import pxgrid
+from contour import contour
+from atlas import atlas
+from dframe import dframe, dcanvas
+from psystem import psystem
 
 import imp, fx, ffmpeg
@@ -0,0 +1,212 @@
+__doc__ = '''Module for the Analysis Cache Implementation'''
+
+import os, glob, array, struct, marshal, hashlib, itertools, collections
+import spa, rcache
+from pxgrid import pxgrid
+
+### Module Constants ###
+
+# NOTE(JRC): Entries begin with a header that identifies the format of their
+# data, which is either a nested list of integers stored as packed arrays (see
+# '_pack') or any other value stored in the 'marshal' format.
+entry_header = struct.Struct('<4scBc')
+entry_magic = b'SPA1'
+
+### Module Functions ###
+
+def cache(cache_id):
+    '''NOTE(JRC): Decorates an image analysis function so that its results are
+    stored in the analysis cache, keyed by the pixel data of the given image
+    (or pixel grid), the code of the function and all of its other arguments.
+    Results are shared between all of the callers in a process, so they must
+    be treated as read-only by all of them.'''
+    def cache_decorator(func):
+        def cache_func(image, *args, **kwargs):
+            analysis_cache = _get_cache()
+            cache_key = _get_key(cache_id, func, image, args, kwargs)
+
+            result = analysis_cache.get(cache_key)
+            if result is None:
+                result = func(image, *args, **kwargs)
+                analysis_cache.put(cache_key, result)
+            return result
+
+        cache_func.__name__, cache_func.__doc__ = func.__name__, func.__doc__
+        return cache_func
+    return cache_decorator
+
+### Module Classes ###
+
+class acache(object):
+    '''NOTE(JRC): A store for the results of image analysis functions, which
+    keeps the most recently used results in memory in front of a directory of
+    binary entries. The least recently used entries are evicted from memory
+    and disk whenever they exceed 'max_memory' and 'max_size' bytes.'''
+    ### Constructors ###
+
+    def __init__(self, path=None, max_size=2**28, max_memory=2**27):
+        self._path = path or spa.analysis_dir
+        self._max_size = max_size
+        self._max_memory = max_memory
+
+        self._results, self._memory = collections.OrderedDict(), 0
+
+    ### Methods ###
+
+    def get(self, key):
+        if key in self._results:
+            result_size, result = self._results.pop(key)
+            self._results[key] = (result_size, result)
+            return result
+
+        # NOTE(JRC): The entry may be evicted or replaced by another process
+        # while it's being read, which is treated as a cache miss.
+        entry_path = os.path.join(self._path, key)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                entry_data = entry_file.read()
+            result = _unpack(entry_data)
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError, EOFError, TypeError, struct.error):
+            return None
+
+        self._remember(key, result, len(entry_data))
+        return result
+
+    def put(self, key, result):
+        entry_data = _pack(result)
+        self._remember(key, result, len(entry_data))
+
+        entry_path = os.path.join(self._path, key)
+        temp_path = os.path.join(self._path, '.{0}-{1}'.format(key, os.getpid()))
+        if not spa.touch(self._path, is_dir=True, force=False): return False
+
+        # NOTE(JRC): Entries are written in full to private files and then
+        # renamed into place, which guarantees that concurrent processes only
+        # ever observe complete entries.
+        try:
+            with open(temp_path, 'wb') as temp_file:
+                temp_file.write(entry_data)
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            return False
+        finally:
+            if os.path.isfile(temp_path): os.remove(temp_path)
+
+        self.evict()
+        return True
+
+    def evict(self):
+        entry_paths = [p for p in glob.glob(os.path.join(self._path, '*')) if os.path.isfile(p)]
+        try:
+            entry_stats = {p: os.stat(p) for p in entry_paths}
+        except OSError:
+            return
+
+        cache_size = sum(s.st_size for s in entry_stats.values())
+        for entry_path in sorted(entry_paths, key=lambda p: entry_stats[p].st_mtime):
+            if cache_size <= self._max_size: break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            cache_size -= entry_stats[entry_path].st_size
+
+    def clear(self):
+        self._results, self._memory = collections.OrderedDict(), 0
+        spa.touch(self._path, is_dir=True, force=True)
+
+    ### Helpers ###
+
+    def _remember(self, key, result, result_size):
+        if key in self._results: self._memory -= self._results.pop(key)[0]
+        self._results[key] = (result_size, result)
+        self._memory += result_size
+
+        while self._memory > self._max_memory and len(self._results) > 1:
+            self._memory -= self._results.popitem(last=False)[1][0]
+
+### Helper Functions ###
+
+def _get_cache():
+    if _get_cache.value is None: _get_cache.value = acache()
+    return _get_cache.value
+_get_cache.value = None
+
+def _get_key(cache_id, func, image, args, kwargs):
+    # NOTE(JRC): Pixel grids are identified by their images, and arguments
+    # that are nested lists of integers (e.g. pixel lists) are hashed in their
+    # packed form since hashing them item by item is very slow for large images.
+    hasher = hashlib.sha1()
+    hasher.update(rcache.digest(cache_id, func, kwargs,
+        image.image if isinstance(image, pxgrid) else image))
+    for arg in args:
+        try:
+            arg_data = _pack_array(arg)
+        except TypeError:
+            arg_data = rcache.digest(arg)
+        hasher.update(struct.pack('<Q', len(arg_data)))
+        hasher.update(arg_data)
+    return hasher.hexdigest()
+
+def _pack(value):
+    try:
+        return _pack_array(value)
+    except TypeError:
+        return entry_header.pack(entry_magic, b'm', 0, b' ') + marshal.dumps(value)
+
+def _pack_array(value):
+    '''NOTE(JRC): Packs the given nested list of integers as the lengths of the
+    lists at each of its levels (top to bottom) followed by all of its integers,
+    which are stored with the smallest type that can hold all of them. Raises
+    a 'TypeError' if the given value isn't a nested list of integers.'''
+    if not isinstance(value, list): raise TypeError('Only lists can be packed.')
+
+    level, level_lengths = [value], []
+    while level and all(isinstance(v, list) for v in level):
+        level_lengths.append(array.array('I', [len(v) for v in level]))
+        level = list(itertools.chain.from_iterable(level))
+
+    level_min, level_max = (min(level), max(level)) if level else (0, 0)
+    level_type = next((t for t in ('BHIL' if level_min >= 0 else 'bhil') if
+        _get_type_range(t)[0] <= level_min and level_max <= _get_type_range(t)[1]), None)
+    if level_type is None: raise TypeError('Only integer lists can be packed.')
+
+    return entry_header.pack(entry_magic, b'a', len(level_lengths), level_type) + \
+        b''.join(l.tostring() for l in level_lengths) + \
+        array.array(level_type, level).tostring()
+
+def _unpack(data):
+    entry_magic_read, entry_kind, entry_depth, entry_type = \
+        entry_header.unpack_from(data)
+    if entry_magic_read != entry_magic: raise ValueError('Invalid cache entry.')
+
+    data_offset = entry_header.size
+    if entry_kind == b'm': return marshal.loads(data[data_offset:])
+
+    level_lengths, level_count = [], 1
+    for level_index in range(entry_depth):
+        lengths = array.array('I')
+        lengths.fromstring(data[data_offset:data_offset + level_count * lengths.itemsize])
+        if len(lengths) != level_count: raise ValueError('Truncated cache entry.')
+        data_offset += level_count * lengths.itemsize
+        level_lengths.append(lengths)
+        level_count = sum(lengths)
+
+    level = array.array(entry_type)
+    level.fromstring(data[data_offset:])
+    if len(level) != level_count: raise ValueError('Truncated cache entry.')
+
+    level = level.tolist()
+    for lengths in reversed(level_lengths):
+        level_start, next_level = 0, []
+        for length in lengths:
+            next_level.append(level[level_start:level_start + length])
+            level_start += length
+        level = next_level
+    return level[0]
+
+def _get_type_range(type_code):
+    type_bits = 8 * array.array(type_code).itemsize
+    return (0, 2**type_bits - 1) if type_code.isupper() else \
+        (-2**(type_bits - 1), 2**(type_bits - 1) - 1)
@@ -0,0 +1,76 @@
+__doc__ = '''Module for the Stencil Atlas Implementation'''
+
+import collections
+import spa, imp, rcache
+from vector import vector
+from PIL import Image
+
+### Module Classes ###
+
+class atlas(object):
+    '''NOTE(JRC): A set of sprites of a stencil rotated (bilinearly, about their
+    centers) to angles quantized to multiples of 'angle_step' degrees, each
+    paired with the offset of its center. Sprites are rendered the first time
+    their angles are requested and then reused, and must be treated as
+    read-only by all of their users.'''
+    ### Class Setup ###
+
+    # NOTE(JRC): Atlases are shared by all of the effects in a process that
+    # use the same stencil (by contents), so scenes that are rendered again
+    # (e.g. while watching files) reuse the sprites of the previous render.
+    max_atlases = 16
+    _atlases = collections.OrderedDict()
+
+    ### Constructors ###
+
+    def __init__(self, stencil_image, angle_step=1.0, expand=True):
+        assert angle_step > 0, 'Cannot quantize stencil angles with a nonpositive step.'
+
+        self._image = stencil_image
+        self._num_angles = max(int(round(360.0 / angle_step)), 1)
+        self._angle_step = 360.0 / self._num_angles
+        self._expand = expand
+        self._resample = spa.resample(Image.BILINEAR)
+        self._sprites = [None] * self._num_angles
+
+    @staticmethod
+    def fetch(stencil_image, angle_step=1.0, expand=True):
+        atlas_key = (rcache.digest(stencil_image), angle_step, expand,
+            spa.resample(Image.BILINEAR))
+
+        stencil_atlas = atlas._atlases.pop(atlas_key, None) or \
+            atlas(stencil_image, angle_step, expand)
+        atlas._atlases[atlas_key] = stencil_atlas
+        while len(atlas._atlases) > atlas.max_atlases:
+            atlas._atlases.popitem(last=False)
+
+        return stencil_atlas
+
+    ### Operators ###
+
+    def __len__(self):
+        return self._num_angles
+
+    ### Properties ###
+
+    @property
+    def image(self):
+        return self._image
+
+    @property
+    def angle_step(self):
+        return self._angle_step
+
+    ### Methods ###
+
+    def index(self, angle):
+        return int(round(angle / self._angle_step)) % self._num_angles
+
+    def get(self, angle):
+        sprite_index = self.index(angle)
+        if self._sprites[sprite_index] is None:
+            sprite_image = self._image.rotate(sprite_index * self._angle_step,
+                resample=self._resample, expand=self._expand)
+            sprite_offset = imp.calc_alignment(vector(2, spa.align.mid), sprite_image)
+            self._sprites[sprite_index] = (sprite_image, sprite_offset)
+        return self._sprites[sprite_index]
@@ -0,0 +1,139 @@
+__doc__ = '''Module for the Contour Geometry Implementation'''
+
+import math, array
+import spa
+from vector import vector
+
+### Module Classes ###
+
+class contour(object):
+    '''NOTE(JRC): The geometry of a stroke (i.e. a list of 1D pixels ordered
+    along a cell boundary), which is calculated in full when the contour is
+    constructed and stored in flat arrays indexed like the stroke. This makes
+    the geometry at each pixel of the stroke a lookup rather than a calculation
+    when stencils and particles are placed along it.'''
+    ### Class Setup ###
+
+    # NOTE(JRC): Tangents are smoothed by averaging the differences between
+    # the pixels this many steps before and after each pixel of the stroke.
+    tangent_span = 4
+
+    ### Constructors ###
+
+    def __init__(self, stroke, image):
+        contour_width, contour_size = image.width, len(stroke)
+        self._xs = array.array('l', [p % contour_width for p in stroke])
+        self._ys = array.array('l', [p // contour_width for p in stroke])
+
+        xs, ys = self._xs.tolist(), self._ys.tolist()
+        self._is_closed = contour_size > 1 and \
+            max(abs(xs[0] - xs[-1]), abs(ys[0] - ys[-1])) == 1
+
+        # NOTE(JRC): The orientation is calculated with the "Shoelace Formula,"
+        # where negative areas indicate clockwise contours in image coordinates.
+        if not self._is_closed:
+            self._orientation = spa.orient.none
+        else:
+            next_xs, next_ys = xs[1:] + xs[:1], ys[1:] + ys[:1]
+            contour_area = sum(x0*y1 for x0, y1 in zip(xs, next_ys)) - \
+                sum(x1*y0 for x1, y0 in zip(next_xs, ys))
+            self._orientation = spa.orient.cw if contour_area < 0 else spa.orient.ccw
+
+        self._arcs = array.array('d', [0.0] * contour_size)
+        for pixel_index in range(1, contour_size):
+            self._arcs[pixel_index] = self._arcs[pixel_index - 1] + math.hypot(
+                xs[pixel_index] - xs[pixel_index - 1], ys[pixel_index] - ys[pixel_index - 1])
+        self._length = (self._arcs[-1] if contour_size else 0.0) + \
+            (math.hypot(xs[0] - xs[-1], ys[0] - ys[-1]) if self._is_closed else 0.0)
+
+        # NOTE(JRC): Tangents are calculated with the same operations (in the
+        # same order) as 'imp.calc_tangent' so that their values are identical,
+        # and normals are rotated from them by a quarter turn against the
+        # orientation of the contour (so they're consistent across contours).
+        tangent_steps = range(1, contour.tangent_span + 1)
+        shift = lambda vs, s: vs[s % len(vs):] + vs[:s % len(vs)]
+        sum_xs = [sum(ds) for ds in zip(*[[n - p for n, p in
+            zip(shift(xs, s), shift(xs, -s))] for s in tangent_steps])] if xs else []
+        sum_ys = [sum(ds) for ds in zip(*[[n - p for n, p in
+            zip(shift(ys, s), shift(ys, -s))] for s in tangent_steps])] if ys else []
+
+        normal_radians = math.radians(-90 if self._orientation == spa.orient.ccw else 90)
+        normal_cos, normal_sin = math.cos(normal_radians), math.sin(normal_radians)
+
+        self._txs, self._tys = array.array('d'), array.array('d')
+        self._nxs, self._nys = array.array('d'), array.array('d')
+        self._angles = array.array('d')
+        for sum_x, sum_y in zip(sum_xs, sum_ys):
+            tangent_x, tangent_y = (0.0 + sum_x) / len(tangent_steps), \
+                (0.0 + sum_y) / len(tangent_steps)
+            tangent_length = math.sqrt(tangent_x * tangent_x + tangent_y * tangent_y)
+            if tangent_length != 0.0:
+                tangent_x, tangent_y = tangent_x / tangent_length, tangent_y / tangent_length
+
+            self._txs.append(tangent_x)
+            self._tys.append(tangent_y)
+            self._nxs.append(normal_cos * tangent_x - normal_sin * tangent_y)
+            self._nys.append(normal_sin * tangent_x + normal_cos * tangent_y)
+            self._angles.append(-math.degrees(math.atan2(tangent_y, tangent_x)))
+
+    ### Operators ###
+
+    def __len__(self):
+        return len(self._xs)
+
+    ### Properties ###
+
+    @property
+    def xs(self):
+        return self._xs
+
+    @property
+    def ys(self):
+        return self._ys
+
+    @property
+    def txs(self):
+        return self._txs
+
+    @property
+    def tys(self):
+        return self._tys
+
+    @property
+    def nxs(self):
+        return self._nxs
+
+    @property
+    def nys(self):
+        return self._nys
+
+    @property
+    def arcs(self):
+        return self._arcs
+
+    @property
+    def angles(self):
+        return self._angles
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def orientation(self):
+        return self._orientation
+
+    @property
+    def is_closed(self):
+        return self._is_closed
+
+    ### Methods ###
+
+    def position(self, index):
+        return vector(2, self._xs[index], self._ys[index])
+
+    def tangent(self, index):
+        return vector(2, self._txs[index], self._tys[index])
+
+    def normal(self, index):
+        return vector(2, self._nxs[index], self._nys[index])
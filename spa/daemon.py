@@ -0,0 +1,242 @@
+__doc__ = '''Module for the Render Daemon Implementation
+
+The daemon accepts requests on a local UNIX socket as JSON objects, one per
+line, and answers each with a single line JSON object that always contains
+an "ok" field (and an "error" field if "ok" is false). The requests are:
+
+- {"command": "submit", "args": [...], "priority": 0}: Queues a render job
+  with the given command line arguments; answers with the job's "id".
+- {"command": "status", "id": 0}: Answers with the "state", "progress" and
+  "error" of the given job, or with the list of all "jobs" if no id is given.
+- {"command": "cancel", "id": 0}: Removes the given job from the queue or
+  stops it if it's running.
+- {"command": "shutdown"}: Stops all running jobs and then the daemon.
+'''
+
+import os, sys, json, heapq, errno, select, signal, socket, traceback
+import spa
+
+### Module Constants ###
+
+jstate_names = ['queued', 'running', 'done', 'failed', 'cancelled']
+jstate = type('Enum', (), {e: i for i, e in enumerate(jstate_names)})
+
+### Module Functions ###
+
+def request(socket_path, command, **kwargs):
+    kwargs['command'] = command
+
+    client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client_socket.connect(socket_path)
+        client_socket.sendall(json.dumps(kwargs) + '\n')
+
+        response_data = ''
+        while not response_data.endswith('\n'):
+            response_chunk = client_socket.recv(4096)
+            if not response_chunk: break
+            response_data += response_chunk
+    finally:
+        client_socket.close()
+
+    return json.loads(response_data)
+
+### Module Classes ###
+
+class daemon(object):
+    '''NOTE(JRC): A render server that runs jobs in order of priority, then
+    submission. Each job is prepared in the daemon process by the given
+    'prepare_job' function, which is given the job's arguments and returns a
+    function that renders the job given a progress callback. This means all
+    the state loaded while preparing jobs (e.g. decoded images) stays warm
+    for later jobs. Each job is rendered in a process forked from the daemon
+    when the job starts, so that it can be stopped (along with all of the
+    processes it starts) at any time; there's no pool of warm processes, so
+    each job also starts its own render worker processes.'''
+    ### Constructors ###
+
+    def __init__(self, socket_path, prepare_job, max_jobs=1):
+        self._socket_path = socket_path
+        self._prepare_job = prepare_job
+        self._max_jobs = max(max_jobs, 1)
+
+        self._jobs, self._job_queue = [], []
+        self._server, self._clients, self._is_stopping = None, {}, False
+
+    ### Methods ###
+
+    def serve(self):
+        if os.path.exists(self._socket_path): os.remove(self._socket_path)
+        self._server = server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(self._socket_path)
+        server_socket.listen(16)
+        spa.log.warning('Listening for render jobs on "{0}".'.format(self._socket_path))
+
+        try:
+            while not self._is_stopping:
+                self._start_jobs()
+
+                job_pipes = {j['pipe']: j for j in self._jobs if j['pipe'] is not None}
+                read_files = [server_socket] + list(self._clients.keys()) + list(job_pipes.keys())
+                try:
+                    ready_files = select.select(read_files, [], [], 0.1)[0]
+                except select.error as e:
+                    if e.args[0] != errno.EINTR: raise
+                    ready_files = []
+
+                for ready_file in ready_files:
+                    if ready_file is server_socket:
+                        client_socket = server_socket.accept()[0]
+                        self._clients[client_socket] = ''
+                    elif ready_file in self._clients:
+                        self._read_client(ready_file)
+                    else:
+                        self._read_job(job_pipes[ready_file])
+
+                self._reap_jobs()
+        finally:
+            for job in self._jobs:
+                if job['state'] == jstate.running: self._stop_job(job)
+            for client_socket in self._clients: client_socket.close()
+            server_socket.close()
+            if os.path.exists(self._socket_path): os.remove(self._socket_path)
+
+    ### Helpers ###
+
+    def _handle(self, message):
+        command = message.get('command')
+        job = self._jobs[message['id']] if isinstance(message.get('id'), int) and \
+            0 <= message['id'] < len(self._jobs) else None
+
+        if command == 'submit':
+            job = {'id': len(self._jobs), 'args': [str(a) for a in message.get('args', [])],
+                'priority': message.get('priority', 0), 'state': jstate.queued,
+                'progress': 0.0, 'error': None, 'pid': None, 'pipe': None, 'output': ''}
+            self._jobs.append(job)
+            heapq.heappush(self._job_queue, (-job['priority'], job['id']))
+            return {'ok': True, 'id': job['id']}
+        elif command == 'status':
+            if 'id' not in message:
+                return {'ok': True, 'jobs': [_get_job_status(j) for j in self._jobs]}
+            elif job is not None:
+                return dict(_get_job_status(job), ok=True)
+        elif command == 'cancel':
+            if job is not None:
+                if job['state'] == jstate.running: self._stop_job(job)
+                if job['state'] in (jstate.queued, jstate.running): job['state'] = jstate.cancelled
+                return dict(_get_job_status(job), ok=True)
+        elif command == 'shutdown':
+            self._is_stopping = True
+            return {'ok': True}
+        else:
+            return {'ok': False, 'error': 'Unknown command "{0}".'.format(command)}
+
+        return {'ok': False, 'error': 'Unknown job "{0}".'.format(message.get('id'))}
+
+    def _read_client(self, client_socket):
+        # NOTE(JRC): Clients can disconnect at any time (e.g. before reading
+        # their responses), which only ends their own connections.
+        try:
+            client_data = client_socket.recv(4096)
+        except socket.error:
+            client_data = ''
+        if not client_data:
+            self._drop_client(client_socket)
+            return
+
+        client_lines = (self._clients[client_socket] + client_data).split('\n')
+        self._clients[client_socket] = client_lines.pop()
+        for client_line in client_lines:
+            try:
+                response = self._handle(json.loads(client_line))
+            except (ValueError, AttributeError):
+                response = {'ok': False, 'error': 'Invalid request "{0}".'.format(client_line)}
+            try:
+                client_socket.sendall(json.dumps(response) + '\n')
+            except socket.error:
+                self._drop_client(client_socket)
+                return
+
+    def _drop_client(self, client_socket):
+        client_socket.close()
+        del self._clients[client_socket]
+
+    def _start_jobs(self):
+        num_running = sum(1 for j in self._jobs if j['state'] == jstate.running)
+        while self._job_queue and num_running < self._max_jobs:
+            job = self._jobs[heapq.heappop(self._job_queue)[1]]
+            if job['state'] != jstate.queued: continue
+
+            try:
+                run_job = self._prepare_job(job['args'])
+            except Exception as e:
+                job['state'], job['error'] = jstate.failed, str(e) or traceback.format_exc()
+                continue
+
+            job_read, job_write = os.pipe()
+            job_pid = os.fork()
+            if job_pid == 0:
+                os.setpgid(0, 0)
+                os.close(job_read)
+                for server_file in [self._server] + list(self._clients.keys()):
+                    server_file.close()
+                _run_job(run_job, job_write)
+
+            os.close(job_write)
+            job['state'], job['pid'], job['pipe'] = jstate.running, job_pid, job_read
+            num_running += 1
+
+    def _read_job(self, job):
+        job_data = os.read(job['pipe'], 4096)
+        if not job_data:
+            os.close(job['pipe'])
+            job['pipe'] = None
+            return
+
+        job_lines = (job['output'] + job_data).split('\n')
+        job['output'] = job_lines.pop()
+        for job_line in job_lines:
+            job.update(json.loads(job_line))
+
+    def _reap_jobs(self):
+        for job in self._jobs:
+            if job['pid'] is not None and job['pipe'] is None:
+                job_pid, job_status = os.waitpid(job['pid'], os.WNOHANG)
+                if job_pid == 0: continue
+
+                job['pid'] = None
+                if job['state'] == jstate.running:
+                    job['state'] = jstate.done if job_status == 0 else jstate.failed
+                    if job['state'] == jstate.done: job['progress'] = 1.0
+
+    def _stop_job(self, job):
+        try:
+            os.killpg(job['pid'], signal.SIGTERM)
+        except OSError:
+            pass
+
+### Helper Functions ###
+
+def _get_job_status(job):
+    return {'id': job['id'], 'args': job['args'], 'priority': job['priority'],
+        'state': jstate_names[job['state']], 'progress': job['progress'],
+        'error': job['error']}
+
+def _run_job(run_job, job_write):
+    '''NOTE(JRC): Runs the given job in the current (forked) process, which
+    reports its progress and errors on the given pipe and then exits.'''
+    def send(**kwargs):
+        os.write(job_write, json.dumps(kwargs) + '\n')
+
+    job_status = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if run_job(lambda p: send(progress=p)):
+            job_status = 0
+        else:
+            send(error='The job failed to render all of its movies.')
+    except BaseException as e:
+        send(error=traceback.format_exc())
+    finally:
+        os.close(job_write)
+        os._exit(job_status)
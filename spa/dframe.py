@@ -0,0 +1,193 @@
+__doc__ = '''Module for the Dirty Frame Implementation'''
+
+import itertools, threading
+
+### Module Classes ###
+
+class dframe(object):
+    '''NOTE(JRC): A frame that's stored as the rectangles it changes in its
+    parent frame (i.e. (box, image) patches), or as a base image if it has no
+    parent. The base image is shared by all of the frames derived from it and
+    must be treated as read-only. Frames are only materialized into full images
+    by 'image', which reuses the last image materialized from the same base.'''
+    ### Class Setup ###
+
+    _versions = itertools.count()
+
+    ### Constructors ###
+
+    def __init__(self, image=None, parent=None, patches=()):
+        assert (image is None) != (parent is None), \
+            'Cannot create a frame without exactly one of an image or a parent.'
+
+        self._parent, self._patches = parent, list(patches)
+        if parent is None:
+            self._root, self._base = self, image
+            self._cursor, self._lock = (None, None), threading.Lock()
+        else:
+            self._root, self._base = parent._root, None
+
+        # NOTE(JRC): Frames that don't change their parents share their parents'
+        # versions, so frames with equal versions always have equal contents.
+        self._version = parent._version if parent is not None and not self._patches \
+            else next(dframe._versions)
+
+    ### Properties ###
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def patches(self):
+        return self._patches
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def mode(self):
+        return self._root._base.mode
+
+    @property
+    def size(self):
+        return self._root._base.size
+
+    @property
+    def width(self):
+        return self._root._base.width
+
+    @property
+    def height(self):
+        return self._root._base.height
+
+    @property
+    def nbytes(self):
+        frame_images = [self._base] if self._base is not None else [p for b, p in self._patches]
+        return sum(i.size[0] * i.size[1] * len(i.getbands()) for i in frame_images)
+
+    ### Methods ###
+
+    def image(self):
+        # NOTE(JRC): The last materialized image of each base is advanced in
+        # place to later frames (e.g. in encoding order), so that each frame
+        # only costs its own patches and a copy of the image.
+        root = self._root
+        with root._lock:
+            cursor_frame, cursor_image = root._cursor
+
+            frame_path, path_frame = [], self
+            while path_frame is not None and path_frame is not cursor_frame:
+                frame_path.append(path_frame)
+                path_frame = path_frame._parent
+            if path_frame is None: cursor_image = root._base.copy()
+
+            for path_frame in reversed(frame_path):
+                for patch_box, patch_image in path_frame._patches:
+                    cursor_image.paste(patch_image, patch_box[:2])
+            root._cursor = (self, cursor_image)
+
+            return cursor_image.copy()
+
+class dcanvas(object):
+    '''NOTE(JRC): A working image for drawing a sequence of frames, each of
+    which is committed as a 'dframe' whose patches cover only the regions that
+    were drawn since the last commit and that differ from the last frame. The
+    given image is never modified, so it must not be modified by its owner
+    while the canvas is in use.'''
+    ### Constructors ###
+
+    def __init__(self, image):
+        self._base = image
+        self._image = image.copy()
+        self._frame_image = image.copy()
+        self._frame = None
+
+        self._dirty_boxes, self._drawn_boxes = [], []
+
+    ### Properties ###
+
+    @property
+    def image(self):
+        return self._image
+
+    @property
+    def frame(self):
+        return self._frame
+
+    ### Methods ###
+
+    def paste(self, image, box=None, mask=None):
+        box = box or (0, 0)
+        self._image.paste(image, box, mask)
+        self._mark(box[:2] + (box[0] + image.size[0], box[1] + image.size[1]))
+
+    def paste_each(self, pastes):
+        '''NOTE(JRC): Pastes each of the given (image, box, mask) items in order,
+        one paste at a time, and marks their bounding box as a single region.
+        Only the region tracking is shared by the pastes, which keeps the number
+        of tracked regions small when many small images are pasted at once.'''
+        paste_bounds = None
+        for image, box, mask in pastes:
+            self._image.paste(image, box, mask)
+            paste_box = box[:2] + (box[0] + image.size[0], box[1] + image.size[1])
+            paste_bounds = paste_box if paste_bounds is None else (
+                min(paste_bounds[0], paste_box[0]), min(paste_bounds[1], paste_box[1]),
+                max(paste_bounds[2], paste_box[2]), max(paste_bounds[3], paste_box[3]))
+        if paste_bounds is not None: self._mark(paste_bounds)
+
+    def alpha_composite(self, image, dest=(0, 0)):
+        self._image.alpha_composite(image, dest=dest)
+        self._mark(tuple(dest) + (dest[0] + image.size[0], dest[1] + image.size[1]))
+
+    def clear(self):
+        '''NOTE(JRC): Restores the original image of the canvas in all of the
+        regions that have been drawn on since the canvas was last cleared.'''
+        for drawn_box in _merge_boxes(self._drawn_boxes):
+            self._image.paste(self._base.crop(drawn_box), drawn_box[:2])
+            self._dirty_boxes.append(drawn_box)
+        self._drawn_boxes = []
+
+    def commit(self):
+        if self._frame is None:
+            self._frame = dframe(self._image.copy())
+            self._frame_image = self._image.copy()
+        else:
+            frame_patches = []
+            for dirty_box in _merge_boxes(self._dirty_boxes):
+                dirty_image = self._image.crop(dirty_box)
+                if dirty_image.tobytes() != self._frame_image.crop(dirty_box).tobytes():
+                    self._frame_image.paste(dirty_image, dirty_box[:2])
+                    frame_patches.append((dirty_box, dirty_image))
+            self._frame = dframe(parent=self._frame, patches=frame_patches)
+
+        self._dirty_boxes = []
+        self._drawn_boxes = _merge_boxes(self._drawn_boxes)
+        return self._frame
+
+    ### Helpers ###
+
+    def _mark(self, box):
+        box = (max(box[0], 0), max(box[1], 0),
+            min(box[2], self._image.size[0]), min(box[3], self._image.size[1]))
+        if box[0] < box[2] and box[1] < box[3]:
+            self._dirty_boxes.append(box)
+            self._drawn_boxes.append(box)
+
+### Helper Functions ###
+
+def _merge_boxes(boxes):
+    '''NOTE(JRC): Returns the given boxes with all of the boxes that overlap
+    replaced by their bounding boxes.'''
+    merged_boxes = []
+    for box in boxes:
+        while True:
+            overlap_index = next((i for i, b in enumerate(merged_boxes) if
+                b[0] < box[2] and box[0] < b[2] and b[1] < box[3] and box[1] < b[3]), None)
+            if overlap_index is None: break
+            overlap_box = merged_boxes.pop(overlap_index)
+            box = (min(box[0], overlap_box[0]), min(box[1], overlap_box[1]),
+                max(box[2], overlap_box[2]), max(box[3], overlap_box[3]))
+        merged_boxes.append(box)
+    return merged_boxes
@@ -7,85 +7,338 @@ please refer to the following documentation pages:
 - H264 Encoding Guide: https://trac.ffmpeg.org/wiki/Encode/H.264
 - Input/Output Rates: https://stackoverflow.com/a/41797724/837221
 - Combining Streams: http://www.bugcodemaster.com/article/concatenate-videos-using-ffmpeg
+- Concatenation: https://trac.ffmpeg.org/wiki/Concatenate
 '''
 
-import os, sys, subprocess
+import os, sys, re, subprocess, threading, tempfile, Queue
 import spa
 
 ### Module Constants ###
 
 encoding = type('Enum', (), {'mp4': 0, 'gif': 1})
 
+# NOTE(JRC): Each encoder profile describes how movies are encoded, where
+# 'threads' is the number of encoder threads (0 lets FFMPEG choose) and 'crf'
+# is the constant rate factor, which is derived from the render quality if
+# it's None. Custom profiles can be added to this dictionary at any time.
+profiles = {
+    'default': {'codec': 'libx264', 'preset': 'medium', 'threads': 0,
+        'pix_fmt': 'yuv420p', 'crf': None, 'args': []},
+    'lossless-fast': {'codec': 'libx264rgb', 'preset': 'ultrafast', 'threads': 0,
+        'pix_fmt': 'rgb24', 'crf': 0, 'args': []},
+    'archival': {'codec': 'libx264', 'preset': 'veryslow', 'threads': 0,
+        'pix_fmt': 'yuv444p', 'crf': None, 'args': []},
+    'web': {'codec': 'libx264', 'preset': 'slow', 'threads': 0,
+        'pix_fmt': 'yuv420p', 'crf': 23, 'args': ['-tune', 'animation',
+        '-profile:v', 'high', '-movflags', '+faststart']},
+}
+
+# NOTE(JRC): The movies for individual sequences are only ever decoded by the
+# final encoding of the movie, so they're encoded losslessly with this fast
+# intra-frame codec instead of a delivery profile. They're stored in QuickTime
+# containers that all share one time base since the concat demuxer assumes
+# that all of the movies it reads share the time base of the first movie.
+intermediate = {'codec': 'ffv1', 'threads': 0, 'pix_fmt': 'bgr0',
+    'args': ['-level', '3', '-g', '1', '-video_track_timescale', '15360']}
+intermediate_ext = 'mov'
+
 ### Module Functions ###
 
-def ffmpeg(path, args, quality=0):
+def ffmpeg(path, args, quality=0, vfr=False, fps=None, profile='default'):
     '''NOTE(JRC): This is a raw FFMPEG call function. This function should
     only be used for internal one-off invocations.'''
-    ffmpeg_args = ['ffmpeg']
-
-    ffmpeg_args.extend(args)
-    ffmpeg_args.extend(['-r', '60', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-y'])
-    ffmpeg_args.extend(['-crf', '0' if quality == 1 else '22'])
-    ffmpeg_args.append(path)
+    ffmpeg_args = _get_ffmpeg_args(path, args, quality=quality, vfr=vfr,
+        fps=fps, profile=profile)
 
     # spa.log.debug(' '.join(ffmpeg_args))
     subprocess.check_output(ffmpeg_args, stderr=subprocess.STDOUT)
 
-def encode(path, out_encoding, fps=60.0, quality=0):
-    if out_encoding == encoding.gif:
-        # NOTE(JRC): GIFs only support FPS specified in terms of delay in
-        # an integer number of milliseconds between frames, so we must convert
-        # the given arbitrary FPS value to a valid, GIF-compliant FPS value.
-        # See this SO answer for details: https://askubuntu.com/a/648604/285545
-        # TODO(JRC): Improve this further by skipping over values likely to
-        # produce bad results (e.g. delay = 3 ms, fps = 33.33333 Hz).
-        gif_fps = 100.0 / round(100.0 / fps)
-
-        # NOTE(JRC): The code below was adapted from the SO answer here:
-        # https://askubuntu.com/a/648604/285545
+def encode(path, out_encoding, fps=60.0, quality=0, profile='default'):
+    '''NOTE(JRC): Encodes the given movie in place with the given encoding and
+    profile, which uses the same single pass as the final encoding of movies.'''
+    path_dir, path_base = os.path.dirname(path), os.path.basename(path)
+    temp_path = os.path.join(path_dir, '.{0}'.format(path_base))
+
+    os.rename(path, temp_path)
+    try:
+        concat(path, temp_path, encoding=out_encoding, fps=fps,
+            quality=quality, profile=profile)
+    finally:
+        os.remove(temp_path)
+
+def render(path, template, fps=60.0, quality=0, holds=None, profile='default'):
+    '''NOTE(JRC): Renders the image sequence with the given template as a
+    movie. If hold counts are given for the images, then each image is shown
+    for that number of frames, which results in a variable frame rate movie
+    that contains each held image only once. If no profile is given, the
+    movie is encoded as an intermediate.'''
+    render_args = [
+        '-framerate', str(fps),
+        '-i', template,
+    ]
+
+    # NOTE(JRC): The timestamp of each image is shifted by the number of extra
+    # frames held by all of the images before it, so the expression used to
+    # calculate timestamps only needs one term for each held image.
+    hold_terms = ['{0}*gt(N,{1})'.format(h - 1, hi) for hi, h in
+        enumerate(holds or []) if h > 1]
+    if hold_terms:
+        render_args.extend(['-vf', "setpts='(N+{0})/(FR*TB)'".format('+'.join(hold_terms))])
+
+    ffmpeg(path, render_args, quality=quality, vfr=bool(hold_terms), fps=fps,
+        profile=profile)
+
+def concat(path, *seq_paths, **kwargs):
+    '''NOTE(JRC): Joins all of the given movies in order and encodes the result
+    with the given encoding and profile in a single FFMPEG invocation. If all
+    of the movies share the same stream parameters, they're read via the concat
+    demuxer; otherwise, they're joined with a single n-input concat filter. If
+    durations are given for the movies, they're used to place each movie in
+    the result in place of the durations of their streams. The result can
+    optionally be cut down to the given span of time (in seconds).'''
+    quality, profile = kwargs.get('quality', 0), kwargs.get('profile', 'default')
+    durations = kwargs.get('durations', None)
+    out_encoding = kwargs.get('encoding', encoding.mp4)
+    out_fps, out_span = kwargs.get('fps', 60.0), kwargs.get('span', None)
+
+    # NOTE(JRC): The joined movie is converted to a constant frame rate before
+    # it's cut down to the span since held frames (e.g. in stills) are stored
+    # as single long frames, which an output seek would drop entirely if they
+    # start before the span.
+    out_filters = []
+    if out_span is not None:
+        out_filters.append('fps={0},trim=start={1}:end={2},setpts=PTS-STARTPTS'.format(
+            out_fps, out_span[0], out_span[1]))
+
+    # NOTE(JRC): Movies with different frame rates and time bases can still be
+    # read with the demuxer since their timestamps are rescaled as they're read.
+    seq_params = [probe(p) for p in seq_paths]
+    if len(set(sp and sp[:3] for sp in seq_params)) == 1:
         path_dir, path_base = os.path.dirname(path), os.path.basename(path)
-        temp_path = os.path.join(path_dir, '.{0}'.format(path_base))
-        palette_path = os.path.join(path_dir,
-            '.{0}.png'.format(os.path.splitext(path_base)[0]))
+        list_path = os.path.join(path_dir,
+            '.{0}.txt'.format(os.path.splitext(path_base)[0]))
 
-        os.rename(path, temp_path)
+        with open(list_path, 'w') as list_file:
+            list_file.write('ffconcat version 1.0\n')
+            for seq_index, seq_path in enumerate(seq_paths):
+                seq_path = os.path.realpath(seq_path).replace("'", "'\\''")
+                list_file.write("file '{0}'\n".format(seq_path))
+                if durations: list_file.write('duration {0}\n'.format(durations[seq_index]))
 
-        # NOTE(JRC): The code below was adapted from the tutorial here:
-        # http://blog.pkh.me/p/21-high-quality-gif-with-ffmpeg.html
-        ffmpeg_args = ['ffmpeg']
-        ffmpeg_args.extend(['-i', temp_path])
-        ffmpeg_args.extend(['-filter:v', 'palettegen', '-y'])
-        ffmpeg_args.append(palette_path)
+        concat_args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+    else:
+        list_path = None
+        concat_args = []
+        for seq_path in seq_paths:
+            concat_args.extend(['-i', seq_path])
+        out_filters.insert(0, '{0}concat=n={1}:v=1'.format(
+            ''.join('[{0}:v:0]'.format(si) for si in range(len(seq_paths))), len(seq_paths)))
 
-        # spa.log.debug(' '.join(ffmpeg_args))
-        subprocess.check_output(ffmpeg_args, stderr=subprocess.STDOUT)
+    try:
+        if out_encoding == encoding.gif:
+            out_filters.append(_get_gif_filter(out_fps))
+
+            ffmpeg_args = ['ffmpeg'] + concat_args
+            ffmpeg_args.extend(['-filter_complex', ','.join(out_filters)])
+            ffmpeg_args.extend(['-f', 'gif', '-y'])
+            ffmpeg_args.append(path)
+
+            # spa.log.debug(' '.join(ffmpeg_args))
+            subprocess.check_output(ffmpeg_args, stderr=subprocess.STDOUT)
+        else:
+            if out_filters:
+                concat_args.extend(['-filter_complex', ','.join(out_filters) + '[v]', '-map', '[v]'])
+            ffmpeg(path, concat_args, quality=quality, fps=out_fps, profile=profile)
+    finally:
+        if list_path is not None: os.remove(list_path)
+
+    if probe(path) is None:
+        raise ValueError('Movie "{0}" has no video frames{1}.'.format(path,
+            '' if out_span is None else ' in span {0}-{1}'.format(*out_span)))
+
+def probe(path):
+    '''NOTE(JRC): Returns a tuple describing the parameters of the first video
+    stream in the given movie (i.e. codec, pixel format, dimensions, frame
+    rate and time base), or None if the movie has no video stream.'''
+    ffmpeg_args = ['ffmpeg', '-hide_banner', '-i', path]
+
+    # NOTE(JRC): FFMPEG always reports an error when it's given no output
+    # file, so its return code is ignored in favor of its stream listing.
+    ffmpeg_process = subprocess.Popen(ffmpeg_args,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    ffmpeg_output = ffmpeg_process.communicate()[0]
 
-        ffmpeg_args = ['ffmpeg']
-        ffmpeg_args.extend(['-i', temp_path, '-i', palette_path])
-        ffmpeg_args.extend(['-filter_complex', 'fps={0}[x];[x][1:v]paletteuse'.format(gif_fps), '-y'])
-        ffmpeg_args.append(path)
+    stream_match = re.search(r'Stream #.*?: Video: (.*)', ffmpeg_output)
+    if not stream_match: return None
 
+    stream_params = [sp.strip() for sp in
+        re.split(r',(?![^(]*\))', stream_match.group(1))]
+    find_param = lambda pattern: next((re.match(pattern, sp).group(1)
+        for sp in stream_params if re.match(pattern, sp)), None)
+
+    return (find_param(r'(\w+)'), stream_params[1].split('(')[0],
+        find_param(r'(\d+x\d+)'), find_param(r'(\S+) fps'), find_param(r'(\S+) tbn'))
+
+def retime(path, scale):
+    '''NOTE(JRC): Scales all of the timestamps in the given movie by the given
+    factor without re-encoding its contents (e.g. 'scale=2.0' doubles the
+    movie's duration).'''
+    path_dir, path_base = os.path.dirname(path), os.path.basename(path)
+    temp_path = os.path.join(path_dir, '.{0}'.format(path_base))
+
+    ffmpeg_args = ['ffmpeg']
+    ffmpeg_args.extend(['-itsscale', str(scale), '-i', path])
+    ffmpeg_args.extend(['-c', 'copy', '-y'])
+    ffmpeg_args.append(temp_path)
+
+    try:
         # spa.log.debug(' '.join(ffmpeg_args))
         subprocess.check_output(ffmpeg_args, stderr=subprocess.STDOUT)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
 
-        # TODO(JRC): Adapt this code so that these files are cleaned up
-        # even if there are errors during processing above.
-        os.remove(palette_path)
-        os.remove(temp_path)
+### Module Classes ###
 
-def render(path, template, fps=60.0, quality=0):
-    render_args = [
-        '-framerate', str(fps),
-        '-i', template,
-    ]
+class stream(object):
+    '''NOTE(JRC): A long-lived FFMPEG process that encodes the frames written
+    to it as a raw RGBA video stream. Frames are handed off to a background
+    thread through a bounded queue, so 'write' blocks whenever more than
+    'buffer_size' frames are awaiting encoding. Frames written with a count
+    are converted once and repeated in the stream, which is always encoded
+    at a constant frame rate. If no profile is given, the stream is encoded
+    as an intermediate.'''
 
-    ffmpeg(path, render_args, quality=quality)
+    ### Constructors ###
 
-def concat(path, lhs_path, rhs_path, quality=0):
-    concat_args = [
-        '-i', lhs_path,
-        '-i', rhs_path,
-        '-filter_complex', '[0:v:0][1:v:0]concat=n=2:v=1[v]', '-map', '[v]',
-    ]
+    def __init__(self, path, size, fps=60.0, quality=0, buffer_size=4, profile='default'):
+        self._size = tuple(size)
+        self._frame_queue = Queue.Queue(maxsize=max(buffer_size, 1))
+        self._frame_count = 0
+        self._write_error = None
+
+        stream_args = [
+            '-f', 'rawvideo', '-pix_fmt', 'rgba',
+            '-s', '{0}x{1}'.format(*self._size),
+            '-framerate', str(fps),
+            '-i', '-',
+        ]
+        self._args = _get_ffmpeg_args(path, stream_args, quality=quality,
+            fps=fps, profile=profile)
+
+        # NOTE(JRC): The output of the process is redirected to a file instead
+        # of a pipe so that a verbose FFMPEG can never stall the encoding.
+        self._log_file = tempfile.TemporaryFile()
+        # spa.log.debug(' '.join(self._args))
+        self._process = subprocess.Popen(self._args, stdin=subprocess.PIPE,
+            stdout=self._log_file, stderr=subprocess.STDOUT)
+
+        self._write_thread = threading.Thread(target=self._write_frames)
+        self._write_thread.daemon = True
+        self._write_thread.start()
+
+    ### Operators ###
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None: self.close()
+        else: self.abort()
+
+    ### Properties ###
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    ### Methods ###
+
+    def write(self, frame, count=1):
+        assert frame.size == self._size, 'Cannot stream frame of differing dimensions.'
+        self._frame_queue.put((frame, count))
+        self._frame_count += count
+
+    def close(self):
+        self._frame_queue.put(None)
+        self._write_thread.join()
+
+        self._process.stdin.close()
+        return_code = self._process.wait()
+
+        self._log_file.seek(0)
+        process_output = self._log_file.read()
+        self._log_file.close()
+
+        if return_code != 0 or self._write_error is not None:
+            raise subprocess.CalledProcessError(return_code or 1,
+                self._args, output=process_output)
+
+    def abort(self):
+        if self._process.poll() is None: self._process.kill()
+        self._frame_queue.put(None)
+        self._write_thread.join()
+
+        self._process.wait()
+        self._log_file.close()
+
+    ### Helpers ###
+
+    def _write_frames(self):
+        while True:
+            frame_item = self._frame_queue.get()
+            if frame_item is None: break
+            frame, frame_count = frame_item
+
+            # NOTE(JRC): Frames continue to be drained after a failed write so
+            # that the producer is never blocked on a dead process; the error
+            # is reported when the stream is closed.
+            if self._write_error is None:
+                try:
+                    frame = frame if frame.mode == 'RGBA' else frame.convert('RGBA')
+                    frame_bytes = frame.tobytes()
+                    for _ in range(frame_count):
+                        self._process.stdin.write(frame_bytes)
+                except (IOError, OSError) as e:
+                    self._write_error = e
+
+### Helper Functions ###
+
+def _get_gif_filter(fps):
+    # NOTE(JRC): GIFs only support FPS specified in terms of delay in
+    # an integer number of milliseconds between frames, so we must convert
+    # the given arbitrary FPS value to a valid, GIF-compliant FPS value.
+    # See this SO answer for details: https://askubuntu.com/a/648604/285545
+    # TODO(JRC): Improve this further by skipping over values likely to
+    # produce bad results (e.g. delay = 3 ms, fps = 33.33333 Hz).
+    gif_fps = 100.0 / round(100.0 / fps)
+
+    # NOTE(JRC): The palette is generated from and applied to the same stream
+    # in one graph (see http://blog.pkh.me/p/21-high-quality-gif-with-ffmpeg.html).
+    # Only the pixels that change between frames contribute to the palette and
+    # are encoded, which makes GIFs smaller and faster to decode.
+    return ('fps={0},split[a][b];[a]palettegen=stats_mode=diff[p];'
+        '[b][p]paletteuse=diff_mode=rectangle').format(gif_fps)
+
+def _get_ffmpeg_args(path, args, quality=0, vfr=False, fps=None, profile='default'):
+    assert profile is None or profile in profiles, \
+        'Unknown encoder profile "{0}".'.format(profile)
+    encoder = profiles[profile] if profile is not None else intermediate
+
+    ffmpeg_args = ['ffmpeg']
+
+    ffmpeg_args.extend(args)
+    if vfr: ffmpeg_args.extend(['-vsync', 'vfr'])
+    elif fps is not None: ffmpeg_args.extend(['-r', str(fps)])
+
+    ffmpeg_args.extend(['-c:v', encoder['codec'], '-pix_fmt', encoder['pix_fmt']])
+    ffmpeg_args.extend(['-threads', str(encoder['threads'])])
+    if 'preset' in encoder:
+        ffmpeg_args.extend(['-preset', 'ultrafast' if spa.preview['enabled'] else encoder['preset']])
+    if 'crf' in encoder:
+        ffmpeg_args.extend(['-crf', str(encoder['crf'] if encoder['crf'] is not None else
+            (0 if quality == 1 else 22))])
+    ffmpeg_args.extend(encoder['args'] + ['-y'])
+    ffmpeg_args.append(path)
 
-    ffmpeg(path, concat_args, quality=quality)
+    return ffmpeg_args
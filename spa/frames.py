@@ -0,0 +1,87 @@
+__doc__ = '''Module for Frame Sequence Functionality'''
+
+from PIL import Image, ImageChops
+from dframe import dframe
+
+### Module Constants ###
+
+hash_size = (16, 16)
+
+### Module Functions ###
+
+def flatten(frame):
+    '''NOTE(JRC): Returns the given frame as a full image, which materializes
+    the frame if it's a dirty frame (see 'dframe').'''
+    return frame.image() if isinstance(frame, dframe) else frame
+
+def fhash(frame):
+    # NOTE(JRC): Frame hashes are calculated from a small, regularly sampled
+    # subset of each frame's pixels, so they can only be used to rule out
+    # matches between frames; see 'matches' for exact comparisons. Dirty frames
+    # are hashed by their versions instead, so that they're never materialized
+    # just to be hashed, which means that runs of dirty frames only collapse
+    # if nothing is changed between them.
+    if isinstance(frame, dframe): return hash((dframe, frame.version))
+    sample_image = frame.resize(hash_size, resample=Image.NEAREST)
+    return hash((frame.mode, frame.size, sample_image.tobytes()))
+
+def matches(frame1, frame2):
+    if frame1 is frame2: return True
+    if frame1.mode != frame2.mode or frame1.size != frame2.size: return False
+
+    # NOTE(JRC): Dirty frames with the same version are always identical, and
+    # dirty frames always differ from their parents unless they share versions.
+    if isinstance(frame1, dframe) and isinstance(frame2, dframe):
+        if frame1.version == frame2.version: return True
+        if frame1.parent is frame2 or frame2.parent is frame1: return False
+
+    frame1, frame2 = flatten(frame1), flatten(frame2)
+    frame_diff = ImageChops.difference(frame1, frame2)
+    return all(band_max == 0 for _, band_max in _get_band_extrema(frame_diff))
+
+def collapse(frames):
+    '''NOTE(JRC): Yields a (frame, count) pair for each run of identical
+    consecutive frames in the given frame sequence.'''
+    run_frame, run_hash, run_count = None, None, 0
+
+    for frame in frames:
+        frame_hash = fhash(frame)
+        if run_count and frame_hash == run_hash and matches(frame, run_frame):
+            run_count += 1
+        else:
+            if run_count: yield run_frame, run_count
+            run_frame, run_hash, run_count = frame, frame_hash, 1
+
+    if run_count: yield run_frame, run_count
+
+def smooth(runs, prev_frame=None, next_frame=None):
+    '''NOTE(JRC): Yields the given (frame, count) runs without the first and
+    last frames if they duplicate the given adjacent frames (i.e. the last
+    frame of the previous sequence and the first frame of the next sequence),
+    which prevents stutters at sequence seams. A frame is never dropped if it
+    would leave the sequence empty.'''
+    held_run, is_first, num_yielded = None, True, 0
+    is_seam = lambda frame, seam_frame: seam_frame is not None and matches(frame, seam_frame)
+
+    for run in runs:
+        if held_run is not None:
+            if is_first and is_seam(held_run[0], prev_frame):
+                held_run[1] -= 1
+            if held_run[1] > 0:
+                yield tuple(held_run)
+                num_yielded += held_run[1]
+            is_first = False
+        held_run = list(run)
+
+    if held_run is not None:
+        if is_first and held_run[1] > 1 and is_seam(held_run[0], prev_frame):
+            held_run[1] -= 1
+        if (num_yielded > 0 or held_run[1] > 1) and is_seam(held_run[0], next_frame):
+            held_run[1] -= 1
+        if held_run[1] > 0: yield tuple(held_run)
+
+### Helper Functions ###
+
+def _get_band_extrema(image):
+    image_extrema = image.getextrema()
+    return image_extrema if isinstance(image_extrema[0], tuple) else (image_extrema,)
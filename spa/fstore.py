@@ -0,0 +1,139 @@
+__doc__ = '''Module for the Frame Store Implementation'''
+
+import os, sys, mmap, tempfile
+from PIL import Image
+from dframe import dframe
+
+### Module Classes ###
+
+class fstore(object):
+    '''NOTE(JRC): A list-like container for the frames of a sequence that keeps
+    at most 'max_size' bytes of frames in memory. Whenever this budget is
+    exceeded, the oldest frames are spilled to a memory-mapped spool file of
+    raw pixel data, from which they're reloaded in their original modes
+    (without copying for the common RGBA frames) on access. Dirty frames (see
+    'dframe') are never spilled since they share their parents' images, so
+    only their own patches count towards the budget.'''
+    ### Class Setup ###
+
+    default_size = 2**30
+    chunk_size = 2**26
+
+    ### Constructors ###
+
+    def __init__(self, frames=(), max_size=None):
+        self._max_size = max_size if max_size is not None else fstore.default_size
+        self._frames, self._frame_size, self._mem_size = [], None, 0
+        self._num_spilled, self._spool_file, self._spool_maps = 0, None, []
+        self._spill_index, self._spill_formats = 0, {}
+        self.extend(frames)
+
+    ### Operators ###
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __iter__(self):
+        for frame_index in range(len(self._frames)):
+            yield self[frame_index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._frames)))]
+
+        frame = self._frames[index]
+        if frame is None:
+            index = index if index >= 0 else index + len(self._frames)
+            frame = self._load(index)
+        return frame
+
+    ### Properties ###
+
+    @property
+    def num_spilled(self):
+        return self._num_spilled
+
+    ### Methods ###
+
+    def append(self, frame):
+        if self._frame_size is None: self._frame_size = frame.size
+        assert frame.size == self._frame_size, 'Cannot store frames of different dimensions.'
+
+        self._frames.append(frame)
+        self._mem_size += _get_frame_bytes(frame)
+        while self._mem_size > self._max_size and self._spill():
+            pass
+
+    def extend(self, frames):
+        for frame in frames: self.append(frame)
+
+    ### Helpers ###
+
+    def _spill(self):
+        # NOTE(JRC): Frames are always spilled from oldest to newest (except
+        # for the newest frame, which is usually about to be used), and each
+        # one's slot in the spool is simply its index in the store.
+        while self._spill_index < len(self._frames) - 1 and \
+                isinstance(self._frames[self._spill_index], dframe):
+            self._spill_index += 1
+        if self._spill_index >= len(self._frames) - 1: return False
+
+        spill_index = self._spill_index
+        spill_frame = self._frames[spill_index]
+        spill_map, spill_offset = self._get_slot(spill_index)
+
+        # NOTE(JRC): Frames are spilled in their own modes whenever their data
+        # fits in their slots (which hold RGBA data), so that they're reloaded
+        # exactly as they were stored; all other frames are stored as RGBA.
+        spill_image = spill_frame
+        spill_bytes = spill_image.tobytes() if spill_image.mode != 'P' else None
+        if spill_bytes is None or len(spill_bytes) > _get_stride(self._frame_size):
+            spill_image = spill_image.convert('RGBA')
+            spill_bytes = spill_image.tobytes()
+        spill_map[spill_offset:spill_offset + len(spill_bytes)] = spill_bytes
+        self._spill_formats[spill_index] = (spill_image.mode, len(spill_bytes))
+
+        self._frames[spill_index] = None
+        self._mem_size -= _get_frame_bytes(spill_frame)
+        self._num_spilled += 1
+        self._spill_index += 1
+        return True
+
+    def _load(self, index):
+        load_map, load_offset = self._get_slot(index)
+        load_mode, load_length = self._spill_formats[index]
+        load_view = _get_view(load_map, load_offset, load_length)
+        return Image.frombuffer(load_mode, self._frame_size, load_view, 'raw', load_mode, 0, 1)
+
+    def _get_slot(self, index):
+        # NOTE(JRC): The spool is mapped in aligned chunks of whole frames so
+        # that it can grow without remapping (and thus invalidating) any of
+        # the frames that have already been reloaded from it.
+        frame_stride = _get_stride(self._frame_size)
+        chunk_frames = max(fstore.chunk_size // frame_stride, 1)
+        chunk_stride = -(-chunk_frames * frame_stride // mmap.ALLOCATIONGRANULARITY) * \
+            mmap.ALLOCATIONGRANULARITY
+
+        chunk_index, chunk_slot = divmod(index, chunk_frames)
+        if self._spool_file is None:
+            self._spool_file = tempfile.TemporaryFile(prefix='spa-fstore-')
+        while len(self._spool_maps) <= chunk_index:
+            map_offset = len(self._spool_maps) * chunk_stride
+            self._spool_file.truncate(map_offset + chunk_stride)
+            self._spool_maps.append(mmap.mmap(self._spool_file.fileno(),
+                chunk_stride, offset=map_offset))
+
+        return self._spool_maps[chunk_index], chunk_slot * frame_stride
+
+### Helper Functions ###
+
+def _get_stride(frame_size):
+    return frame_size[0] * frame_size[1] * 4
+
+def _get_frame_bytes(frame):
+    if isinstance(frame, dframe): return frame.nbytes
+    return frame.size[0] * frame.size[1] * len(frame.getbands())
+
+def _get_view(buffer_map, offset, length):
+    if sys.version_info[0] < 3: return buffer(buffer_map, offset, length)
+    else: return memoryview(buffer_map)[offset:offset + length]
@@ -3,7 +3,12 @@ __doc__ = '''Module for the Image Effects Functionality'''
 import os, random, collections
 import spa, imp
 from vector import vector
-from PIL import Image
+from fstore import fstore
+from contour import contour
+from atlas import atlas
+from psystem import psystem
+from dframe import dframe, dcanvas
+from PIL import Image, ImageChops, ImageMath
 
 ### Module Functions ###
 
@@ -12,56 +17,65 @@ def sstroke(canvas_image, cell_image,
         stroke_offset=vector(2, spa.align.mid),
         stencil=None,
         stencil_rate=1,            # units: pixels / stencil imprint
+        stencil_step=1.0,          # units: degrees / stencil rotation
         **kwargs):
     # NOTE(JRC): Any pixel in the stencil with the color magenta will inherit
     # the color from the source 'cell_image' during the embedding process.
     stencil_color = stencil if isinstance(stencil, tuple) else spa.colorize('magenta')
     stencil_image = stencil if isinstance(stencil, Image.Image) else \
         Image.new('RGBA', (1, 1), color=stencil_color)
+    stencil_atlas = atlas.fetch(stencil_image, stencil_step, expand=True)
 
     stroke_offset = imp.calc_alignment(stroke_offset, canvas_image, cell_image)
     to_canvas = lambda sp: imp.to_pixel(sp + stroke_offset)
 
     stroke_cells = imp.calc_opaque_cells(cell_image)
     stroke_bounds = imp.calc_cell_boundaries(cell_image, stroke_cells)
-    strokes = imp.calc_cell_strokes(cell_image, stroke_bounds)
-    stroke_to_cell = {id(sl): sli for sli, sls in enumerate(strokes) for sl in sls}
+    cell_strokes = imp.calc_cell_strokes(cell_image, stroke_bounds)
 
     # NOTE(JRC): Each item in the 'ordered_strokes' list is a list that
     # enumerates a set of strokes that can performed concurrently.
-    strokes = [sl for sls in strokes for sl in sls]
+    strokes = [sl for sls in cell_strokes for sl in sls]
     if stroke_image:
-        # NOTE(JRC): The 'stroke_to_cell' dictionary doesn't need to be updated
-        # after these calls since the associated functions don't change the
-        # memory addresses of any of the base lists that they're given.
-        oriented_strokes = imp.orient_cell_strokes(cell_image, stroke_image, strokes)
-        ordered_strokes = imp.order_cell_strokes(cell_image, stroke_image, oriented_strokes)
+        # NOTE(JRC): The oriented strokes are new lists listed in the same
+        # order as the given strokes, and 'order_cell_strokes' doesn't change
+        # the memory addresses of any of the base lists that it's given.
+        strokes = imp.orient_cell_strokes(cell_image, stroke_image, strokes)
+        ordered_strokes = imp.order_cell_strokes(cell_image, stroke_image, strokes)
     else:
         ordered_strokes = [strokes]
-
-    frame_images = [canvas_image.copy()]
+    stroke_to_cell = {id(sl): sli for sl, sli in zip(strokes,
+        [sli for sli, sls in enumerate(cell_strokes) for sl in sls])}
+    stroke_contours = {id(sl): contour(sl, cell_image) for sl in strokes}
+    stroke_masks = {}
+
+    # NOTE(JRC): Each frame is committed as the regions that were stamped
+    # since the previous frame, so that frames aren't copied in full.
+    stroke_canvas = dcanvas(canvas_image)
+    frame_images = fstore([stroke_canvas.commit()])
     for curr_strokes in ordered_strokes:
         num_frames = max(len(sl) for sl in curr_strokes)
         stroke_fills = [spa.distribute(len(s), num_frames) for s in curr_strokes]
         for frame_index in range(num_frames):
-            frame_image = frame_images[-1].copy()
             for stroke, stroke_fill in zip(curr_strokes, stroke_fills):
-                stroke_cell = stroke_cells[stroke_to_cell[id(stroke)]]
+                stroke_cell = stroke_to_cell[id(stroke)]
+                if stroke_cell not in stroke_masks:
+                    stroke_masks[stroke_cell] = _calc_cell_mask(stroke_cells[stroke_cell], cell_image)
+                stroke_mask = stroke_masks[stroke_cell]
+                stroke_contour = stroke_contours[id(stroke)]
                 for stroke_index in stroke_fill[frame_index]:
                     # NOTE(JRC): This has the potential to create weird artifacting
                     # if a stroke fills many on-rate in a single frame.
                     if stroke_index % stencil_rate != 0: continue
-                    pixel_offset = imp.to_2d(stroke[stroke_index], cell_image, True)
-                    pixel_tangent = imp.calc_tangent(stroke, stroke_index, cell_image)
-
-                    pixel_stencil_image = stencil_image.rotate(
-                        vector(2, 1.0, 0.0).angleto(pixel_tangent),
-                        resample=Image.BILINEAR, expand=True)
+                    pixel_offset = stroke_contour.position(stroke_index)
+                    pixel_stencil_image, pixel_stencil_align = \
+                        stencil_atlas.get(stroke_contour.angles[stroke_index])
 
-                    pixel_stencil_offset = pixel_offset - \
-                        imp.calc_alignment(vector(2, spa.align.mid), pixel_stencil_image)
-                    cell_stencil_image = cell_image.crop(pixel_stencil_offset.dvals + \
-                        (pixel_stencil_offset + vector(2, *pixel_stencil_image.size)).dvals)
+                    pixel_stencil_offset = pixel_offset - pixel_stencil_align
+                    pixel_stencil_box = pixel_stencil_offset.dvals + \
+                        (pixel_stencil_offset + vector(2, *pixel_stencil_image.size)).dvals
+                    cell_stencil_image = cell_image.crop(pixel_stencil_box)
+                    cell_stencil_mask = _cut_cell_mask(stroke_mask, cell_image, pixel_stencil_box)
 
                     # NOTE(JRC): This code enforces stencil color/alpha rules:
                     # - If the stencil has color magenta at a pixel, then it
@@ -69,29 +83,12 @@ def sstroke(canvas_image, cell_image,
                     #   uses its own color.
                     # - If the pixel is outside the current cell being colored,
                     #   then it is automatically zeroed out (prevents artifacts).
-                    cell_color_data = cell_stencil_image.getdata()
-                    pixel_stencil_data = []
-                    for cell_index, cell_rgba in enumerate(cell_color_data):
-                        index_local_offset = imp.to_2d(cell_index, cell_stencil_image, True)
-                        index_local_pixel = imp.to_pixel(index_local_offset)
-                        index_global_offset = pixel_stencil_offset + index_local_offset
-                        index_global_pixel = imp.to_pixel(index_global_offset)
-                        index_global_1d = imp.to_1d(index_global_pixel, cell_image)
-
-                        stencil_rgba = pixel_stencil_image.getpixel(index_local_pixel)
-                        cell_color, stencil_color = spa.color(*cell_rgba), spa.color(*stencil_rgba)
-
-                        index_rgb = cell_color.rgb \
-                            if stencil_color.matches('magenta') else stencil_color.rgb
-                        index_a = cell_color.composite(stencil_color).a \
-                            if index_global_1d in stroke_cell else 0
-
-                        pixel_stencil_data.append(index_rgb + (index_a,))
-                    pixel_stencil_image.putdata(pixel_stencil_data)
-
-                    frame_image.alpha_composite(pixel_stencil_image,
+                    pixel_stencil_image = _stamp_stencil(pixel_stencil_image,
+                        cell_stencil_image, cell_stencil_mask)
+
+                    stroke_canvas.alpha_composite(pixel_stencil_image,
                         dest=to_canvas(pixel_stencil_offset))
-            frame_images.append(frame_image)
+            frame_images.append(stroke_canvas.commit())
 
     return frame_images
 
@@ -103,14 +100,14 @@ def scale(scale_image, scale_func,
 
     scale_canvas = Image.new('RGBA', scale_image.size, color=fill_color)
 
-    frame_images = []
+    frame_images = fstore()
     for frame_index in range(ffx.num_frames):
         canvas_image = scale_canvas.copy()
 
         frame_scale = scale_func(frame_index / max(ffx.num_frames - 1.0, 1.0))
         frame_scale_2d = tuple(int(frame_scale*d) for d in canvas_image.size)
 
-        frame_image = scale_image.resize(frame_scale_2d, resample=Image.LANCZOS)
+        frame_image = scale_image.resize(frame_scale_2d, resample=spa.resample(Image.LANCZOS))
         frame_offset = imp.calc_alignment(scale_origin, canvas_image, frame_image)
         canvas_image.paste(frame_image, imp.to_pixel(frame_offset), frame_image)
 
@@ -125,6 +122,7 @@ def pop(canvas_image, pop_image,
         pop_rotation=90,          # units: degrees / timescale
         pop_scale=0.07,           # units: pop image %
         pop_stencil=None,
+        pop_step=1.0,             # units: degrees / stencil rotation
         pop_seed=None,
         **kwargs):
     ffx = _get_fxdata(**kwargs)
@@ -136,76 +134,72 @@ def pop(canvas_image, pop_image,
     pop_cells = imp.calc_opaque_cells(pop_image)
     pop_bounds = imp.calc_cell_boundaries(pop_image, pop_cells)
     pop_strokes = imp.calc_cell_strokes(pop_image, pop_bounds)
-    pop_contours = [sorted(psl, key=lambda p: len(p))[-1] for psl in pop_strokes]
+    pop_contours = [contour(sorted(psl, key=lambda p: len(p))[-1], pop_image)
+        for psl in pop_strokes]
 
     # Scale Parameters to Fit Image #
 
     scale_baseline = min(*pop_image.size)
     if pop_scale is not None:
         stencil_scale = vector(2, pop_scale * scale_baseline)
-        pop_stencil = pop_stencil.resize(imp.to_pixel(stencil_scale), resample=Image.LANCZOS)
+        pop_stencil = pop_stencil.resize(imp.to_pixel(stencil_scale), resample=spa.resample(Image.LANCZOS))
 
     stencil_offset = imp.calc_alignment(vector(2, spa.align.mid), pop_stencil)
+    stencil_atlas = atlas.fetch(pop_stencil, pop_step, expand=False)
     pop_velocity *= scale_baseline
 
     # Generate Contour Particles #
 
-    pop_particles = []
-    for contour in pop_contours:
-        contour_orient = imp.calc_orientation(contour, pop_image)
-        contour_dir = -1 if contour_orient == spa.orient.ccw else 1
+    pop_particles = psystem()
+    for pop_contour in pop_contours:
         contour_distrib = spa.distribute(
-            int(pop_rate), len(contour), bucket_limit=1, is_cyclic=True)
+            int(pop_rate), len(pop_contour), bucket_limit=1, is_cyclic=True)
 
         # TODO(JRC): Consider adding randomness to the following attributes:
         # - Start Angle
         # - Velocity Magnitude
         # - Velocity Vector
         # - Rotation Magnitude
-        contour_particles = []
-        for pixel_index, pixel_particles in enumerate(contour_distrib):
-            if not pixel_particles: continue
-            pixel_pos = imp.to_2d(contour[pixel_index], pop_image, True)
-            pixel_angle = 0
-
-            pixel_tangent = imp.calc_tangent(contour, pixel_index, pop_image)
-            pixel_normal = pixel_tangent.irotate(contour_dir * 90)
-
-            pixel_velocity = (pop_velocity / float(ffx.num_frames)) * pixel_normal
-            pixel_rotation = (1.0 / float(ffx.num_frames)) * pop_rotation
-
-            contour_particles.append([
-                pixel_pos, pixel_angle,
-                pixel_velocity, pixel_rotation])
-
-        pop_particles.extend(contour_particles)
+        pop_particles.emit(pop_contour,
+            [pi for pi, pps in enumerate(contour_distrib) if pps],
+            speed=pop_velocity / float(ffx.num_frames),
+            spin=(1.0 / float(ffx.num_frames)) * pop_rotation)
 
     # Simulate Particles for Duration #
 
     alpha_func = lambda fu: 0 + 4*fu - 4*fu**2
-    to_canvas = lambda pp: imp.to_pixel((pp + pop_offset) - stencil_offset)
+    to_canvas_x = lambda px: int((px + pop_offset[0]) - stencil_offset[0])
+    to_canvas_y = lambda py: int((py + pop_offset[1]) - stencil_offset[1])
+
+    # NOTE(JRC): The particles of the previous frame are erased from the canvas
+    # before each frame is drawn, so that frames only store the regions that
+    # the particles cover.
+    pop_canvas = dcanvas(canvas_image)
 
-    frame_images = []
+    frame_images = fstore()
     for frame_index in range(ffx.num_frames):
-        frame_image = canvas_image.copy()
-        stencil_image = pop_stencil.copy()
+        pop_canvas.clear()
 
+        # NOTE(JRC): The particle alpha is applied to each rotated stencil once
+        # per frame, since particles usually share their rotations.
         particle_alpha = alpha_func(frame_index / max(ffx.num_frames - 1.0, 1.0))
-        # TODO(JRC): Figure out a better workflow for modifying the alpha values
-        # of the original image in batch.
-        alpha_data = stencil_image.getdata(band=3)
-        alpha_image = Image.new('L', stencil_image.size)
-        alpha_image.putdata([int(particle_alpha*a) for a in alpha_data])
-        stencil_image.putalpha(alpha_image)
+        particle_table = [int(particle_alpha*a) for a in range(256)]
+        particle_images = {}
 
-        for particle in pop_particles:
-            particle_image = stencil_image.rotate(particle[1], resample=Image.BILINEAR)
-            frame_image.paste(particle_image, to_canvas(particle[0]), particle_image)
+        particle_xs, particle_ys = pop_particles.positions(frame_index)
+        particle_indices = [stencil_atlas.index(pa) for pa in
+            pop_particles.rotations(frame_index)]
+        for particle_index in set(particle_indices):
+            particle_image = stencil_atlas.get(
+                particle_index * stencil_atlas.angle_step)[0].copy()
+            particle_image.putalpha(particle_image.getchannel('A').point(particle_table))
+            particle_images[particle_index] = particle_image
 
-            particle[0] += particle[2]
-            particle[1] += particle[3]
+        pop_canvas.paste_each((particle_images[pi], (to_canvas_x(px), to_canvas_y(py)),
+            particle_images[pi]) for pi, px, py in
+            zip(particle_indices, particle_xs, particle_ys))
 
-        frame_images.append(frame_image)
+        frame_images.append(pop_canvas.commit())
 
     return frame_images
 
@@ -227,22 +221,22 @@ def fade(in_image, out_image,
 
         # TODO(JRC): Remove the duplicate frame that will almost inevitably be
         # generated between these two frame sequences.
-        frame_images = []
+        frame_images = fstore()
         frame_images.extend(fade(in_image, fade_image,
             fade_func=fade_func, num_frames=in_num_frames))
         frame_images.extend(fade(fade_image, out_image,
             fade_func=fade_func, num_frames=out_num_frames))
     else:
-        frame_images = []
+        # NOTE(JRC): The bands of the end images are split once and shared by
+        # all of the frames, which only replace the alpha bands of the images.
+        end_bands = [i.convert('RGBA').split() for i in [in_image, out_image]]
+
+        frame_images = fstore()
         for frame_index in range(ffx.num_frames):
-            frame_end_images = [i.copy() for i in [in_image, out_image]]
             frame_end_alphas = fade_func(frame_index / max(ffx.num_frames - 1.0, 1.0))
-
-            for end_image, end_alpha in zip(frame_end_images, frame_end_alphas):
-                alpha_data = end_image.getdata(band=3)
-                alpha_image = Image.new('L', end_image.size)
-                alpha_image.putdata([int(end_alpha * ia) for ia in alpha_data])
-                end_image.putalpha(alpha_image)
+            frame_end_images = [Image.merge('RGBA', bands[:3] +
+                    (bands[3].point([int(end_alpha * a) for a in range(256)]),))
+                for bands, end_alpha in zip(end_bands, frame_end_alphas)]
 
             frame_image = Image.alpha_composite(*tuple(frame_end_images))
             frame_images.append(frame_image)
@@ -251,7 +245,7 @@ def fade(in_image, out_image,
 
 def still(in_image, still_color=spa.colorize('white'), **kwargs):
     if not still_color:
-        return [in_image.copy()]
+        return [dframe(in_image)]
     else:
         still_image = Image.new('RGBA', in_image.size, color=still_color)
         still_image.paste(in_image, mask=in_image)
@@ -267,3 +261,47 @@ def _get_fxdata(**kwargs):
     fxargs = {'num_frames': 0}
     fxargs = {k: kwargs.get(k, 0) for k, v in fxargs.iteritems()}
     return fxdata(**fxargs)
+
+def _calc_cell_mask(cell, image):
+    cell_mask = bytearray(image.width * image.height)
+    for cell_pixel in cell: cell_mask[cell_pixel] = 255
+    return cell_mask
+
+def _cut_cell_mask(cell_mask, image, box):
+    # NOTE(JRC): Each row of the box is cut from the flat cell mask as a run of
+    # 1D pixels, so columns past the left and right edges of the image wrap
+    # onto the adjacent rows (as they always have for stencil membership).
+    box_width, box_height = box[2] - box[0], box[3] - box[1]
+
+    box_rows = []
+    for box_y in range(box[1], box[3]):
+        row_start = box_y * image.width + box[0]
+        row_end = row_start + box_width
+        clip_start, clip_end = max(row_start, 0), min(row_end, len(cell_mask))
+        if clip_start >= clip_end:
+            box_rows.append(bytearray(box_width))
+        else:
+            box_rows.extend([bytearray(clip_start - row_start),
+                cell_mask[clip_start:clip_end], bytearray(row_end - clip_end)])
+
+    return Image.frombytes('L', (box_width, box_height), bytes(bytearray().join(box_rows)))
+
+def _stamp_stencil(stencil_image, cell_image, cell_mask):
+    '''NOTE(JRC): Returns the given stencil with the colors of the given cell
+    image in place of its magenta pixels and with its alpha multiplied by the
+    alpha of the cell image within the given cell mask (and zeroed outside of
+    it). The alpha is rounded like 'spa.color.composite' so that stamps are
+    identical to those made by compositing their pixels one at a time.'''
+    if stencil_image.mode != 'RGBA': stencil_image = stencil_image.convert('RGBA')
+    if cell_image.mode != 'RGBA': cell_image = cell_image.convert('RGBA')
+    stencil_bands, cell_bands = stencil_image.split(), cell_image.split()
+
+    key_mask = reduce(ImageChops.darker, [b.point(t) for b, t in
+        zip(stencil_bands[:3], _stamp_stencil.key_tables)])
+    stamp_image = Image.composite(cell_image, stencil_image, key_mask)
+    stamp_image.putalpha(ImageMath.eval('convert((c * s + 127) / 255 * (m / 255), "L")',
+        c=cell_bands[3], s=stencil_bands[3], m=cell_mask))
+
+    return stamp_image
+_stamp_stencil.key_tables = [[255 if v == kv else 0 for v in range(256)]
+    for kv in spa.colorize('magenta').rgb]
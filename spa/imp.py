@@ -1,8 +1,11 @@
 __doc__ = '''Module for the Image Processing Functionality'''
 
-import sys, colorsys, collections
-import spa
+import re, sys, array, weakref, colorsys, collections
+import spa, acache
+from PIL import Image, ImageChops, ImageFilter
 from vector import vector
+from dsets import dsets
+from pxgrid import pxgrid
 
 # TODO(JRC): Do an audit of the names in this function and make improvements
 # where necessary.
@@ -12,7 +15,7 @@ from vector import vector
 ## Color Functions ##
 
 def is_opaque(pixel, image):
-    return image.getpixel(to_2d(pixel, image))[3] != 0
+    return calc_grid(image).is_opaque(pixel)
 
 def distrib_colors(count):
     hues = [(1.0/count)*i for i in range(count)]
@@ -44,11 +47,7 @@ def to_pixel(vector):
     return tuple(int(vector[d]) for d in range(vector.dim))
 
 def calc_adjacent(pixel, image):
-    px, py = to_2d(pixel, image)
-    return [
-        to_1d(px+dx, py+dy, image) for dx in range(-1, 2) for dy in range(-1, 2)
-        if 0 <= px+dx < image.width and 0 <= py+dy < image.height
-        and to_1d(px+dx, py+dy, image) != pixel]
+    return calc_grid(image).adjacent(pixel)
 
 # TODO(JRC): Consider adding support for alignment by percentages as well.
 def calc_alignment(align_coords, image, subimage=None):
@@ -75,10 +74,11 @@ def calc_alignment(align_coords, image, subimage=None):
 def calc_orientation(boundary, image):
     bound_orient = None
 
-    if boundary[0] not in calc_adjacent(boundary[-1], image):
+    grid = calc_grid(image)
+    if boundary[0] not in grid.adjacent(boundary[-1]):
         bound_orient = spa.orient.none
     else:
-        boundary_2d = [to_2d(bp, image) for bp in boundary]
+        boundary_2d = grid.to_2d(boundary)
         boundary_shoelace = zip(boundary_2d, boundary_2d[1:] + [boundary_2d[0]])
         boundary_orient = (
             sum(p0[0]*p1[1] for p0, p1 in boundary_shoelace) -
@@ -100,15 +100,31 @@ def calc_tangent(boundary, index, image):
     return tangent_average
 
 def is_cell_boundary(curr_pixel, next_pixel, image):
-    curr_alpha = image.getpixel(to_2d(curr_pixel, image))[3]
-    next_alpha = image.getpixel(to_2d(next_pixel, image))[3]
+    grid = calc_grid(image)
+    curr_alpha, next_alpha = grid.alpha(curr_pixel), grid.alpha(next_pixel)
     return curr_alpha * next_alpha == 0 and curr_alpha + next_alpha != 0
 
 ## Processing Functions ##
 
+def calc_grid(image):
+    '''NOTE(JRC): Returns the pixel grid for the given image (or the given grid
+    itself), which is built once per image object and then reused by all of
+    the analysis functions in this module. Like the image digests used by the
+    render cache, this assumes that analyzed images aren't modified in place.'''
+    if isinstance(image, pxgrid): return image
+
+    grid_ref, grid = calc_grid.memo.get(id(image), (None, None))
+    if grid_ref is None or grid_ref() is not image:
+        grid = pxgrid(image)
+        calc_grid.memo[id(image)] = (weakref.ref(image), grid)
+    return grid
+calc_grid.memo = {}
+
 def calc_connected_components(image, pixel_set, are_adjacent):
     components = []
 
+    grid = calc_grid(image)
+
     visited_pixels = set()
     for curr_pixel in pixel_set:
         if curr_pixel not in visited_pixels:
@@ -121,7 +137,7 @@ def calc_connected_components(image, pixel_set, are_adjacent):
                     visited_pixels.add(component_pixel)
                     component.append(component_pixel)
 
-                    adj_pixels = calc_adjacent(component_pixel, image)
+                    adj_pixels = grid.adjacent(component_pixel)
                     component_pixels.extend(
                         adj_pixel for adj_pixel in adj_pixels if
                         (adj_pixel in pixel_set and
@@ -132,7 +148,7 @@ def calc_connected_components(image, pixel_set, are_adjacent):
     return components
 
 def calc_connected_bbox(image, component):
-    component_2d = [to_2d(p, image) for p in component]
+    component_2d = calc_grid(image).to_2d(component)
 
     component_min = tuple(min(p[d] for p in component_2d) for d in range(2))
     component_max = tuple(max(p[d] for p in component_2d) for d in range(2))
@@ -140,28 +156,169 @@ def calc_connected_bbox(image, component):
     return (component_min[0], component_min[1],
         component_max[0]-component_min[0], component_max[1]-component_min[1])
 
-@spa.cache('comps')
+def calc_cell_labels(image):
+    '''NOTE(JRC): Returns the list of the 8-connected cells of opaque pixels
+    in the given image along with a map from each pixel to the number of its
+    cell (starting from 1, with 0 for transparent pixels). Cells are ordered
+    by their first pixels and their pixels are listed in scanline order.'''
+    grid = calc_grid(image)
+    return _calc_mask_labels(grid.alphas, grid.size)
+
+@acache.cache('comps')
 def calc_opaque_cells(image):
-    opaque_pixels = set(p for p in range(image.width * image.height) if
-        is_opaque(p, image))
-    return calc_connected_components(image, opaque_pixels,
-        lambda cp, ap, i: not is_cell_boundary(cp, ap, i))
+    return calc_cell_labels(image)[0]
 
-@spa.cache('bounds')
+@acache.cache('bounds')
 def calc_cell_boundaries(image, cells):
-    boundaries = []
-
-    for cell in cells:
-        boundary_pixels = set(cp for cp in cell if
-            any(is_cell_boundary(cp, ap, image) for ap in calc_adjacent(cp, image)))
-
-        boundary_list = calc_connected_components(image, boundary_pixels,
-            lambda cp, ap, i: True)
-        boundaries.append(boundary_list)
+    # NOTE(JRC): The boundary pixels of all cells are found at once as the
+    # opaque pixels that are removed by eroding the opaque mask of the image,
+    # which is padded so that pixels on the image border aren't removed.
+    grid = calc_grid(image)
+    opaque_mask = Image.frombytes('L', grid.size, bytes(grid.alphas)).point(
+        lambda a: 255 if a else 0)
+    eroded_mask = Image.new('L', (grid.width + 2, grid.height + 2), 255)
+    eroded_mask.paste(opaque_mask, (1, 1))
+    eroded_mask = eroded_mask.filter(ImageFilter.MinFilter(3)).crop(
+        (1, 1, grid.width + 1, grid.height + 1))
+    boundary_mask = ImageChops.subtract(opaque_mask, eroded_mask)
+
+    cell_map = array.array('L', [0]) * len(grid)
+    for cell_index, cell in enumerate(cells):
+        for cell_pixel in cell: cell_map[cell_pixel] = cell_index + 1
+
+    boundaries = [[] for cell in cells]
+    for boundary in _calc_mask_labels(boundary_mask.tobytes(), grid.size)[0]:
+        boundary_cell = cell_map[boundary[0]]
+        if boundary_cell: boundaries[boundary_cell - 1].append(boundary)
 
     return boundaries
 
 def calc_cell_strokes(image, boundaries):
+    '''NOTE(JRC): Returns a stroke for each of the given cell boundaries, which
+    lists the pixels along the outside of the boundary in the order that
+    they're encountered when walking around it (so the first and last pixels
+    of each stroke are adjacent). Pixels on one pixel wide spurs of a boundary
+    are listed once on the way out and again on the way back.'''
+    return [[_trace_boundary(b, image) for b in bl] for bl in boundaries]
+
+def orient_cell_strokes(image, orient_image, strokes):
+    assert image.size == orient_image.size, 'The given image sizes do not match.'
+
+    oriented_strokes = []
+
+    orient_grid = calc_grid(orient_image)
+    stroke_orient_pixels = [
+        next((p for p in s if orient_grid.is_opaque(p)), None)
+        for s in strokes]
+
+    # TODO(JRC): Add a check here that ensures that all of the non-opaque
+    # pixels are used in the given 'orient_image'.
+
+    # NOTE(JRC): The given strokes are usually shared analysis results (see
+    # 'acache.cache'), so they're copied rather than oriented in place.
+    for stroke, orient_pixel in zip(strokes, stroke_orient_pixels):
+        oriented_stroke = list(stroke)
+        if orient_pixel:
+            orient_index = stroke.index(orient_pixel)
+            oriented_stroke = stroke[orient_index:] + stroke[:orient_index]
+
+            orient_alpha = orient_grid.alpha(orient_pixel)
+            want_orient = spa.orient.cw if orient_alpha == 255 else spa.orient.ccw
+            curr_orient = calc_orientation(oriented_stroke, image)
+            if curr_orient != want_orient : oriented_stroke.reverse()
+        oriented_strokes.append(oriented_stroke)
+
+    return oriented_strokes
+
+def order_cell_strokes(image, orient_image, strokes):
+    # TODO(JRC): There are still bugs in this code when grouping the pixels
+    # into bins.
+    assert image.size == orient_image.size, 'The given image sizes do not match.'
+
+    orient_grid = calc_grid(orient_image)
+    stroke_orient_pixels = [
+        next((p for p in s if orient_grid.is_opaque(p)), None)
+        for s in strokes]
+
+    # TODO(JRC): Add a check here that ensures that all of the non-opaque
+    # pixels are used in the given 'orient_image'.
+
+    orient_color_to_strokes = collections.defaultdict(list)
+    orient_extra_strokes = []
+    for stroke, orient_pixel in zip(strokes, stroke_orient_pixels):
+        if orient_pixel:
+            orient_color = orient_grid.color(orient_pixel)[:3]
+            orient_color_to_strokes[orient_color].append(stroke)
+        else:
+            orient_extra_strokes.append(stroke)
+
+    # TODO(JRC): Improve this behavior if default binning missing strokes
+    # becomes important in the future.
+    orient_color_to_strokes[orient_color_to_strokes.keys()[0]].extend(orient_extra_strokes)
+
+    ordered_strokes = [orient_color_to_strokes[c] for c in
+        sorted(orient_color_to_strokes.keys(),
+        key=lambda c: colorsys.rgb_to_hsv(*c)[::-1] if c else (1.0, 1.0, 1.0))]
+
+    return ordered_strokes
+
+### Helper Functions ###
+
+# NOTE(JRC): The offsets to the neighbours of a pixel in clockwise order
+# (in image coordinates), starting from its west neighbour.
+_moore_offsets = [(-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1)]
+
+def _calc_mask_labels(mask_bytes, mask_size):
+    '''NOTE(JRC): Returns the 8-connected components of the nonzero pixels in
+    the given mask and a map from each pixel to the number of its component
+    (starting from 1) in the format described by 'calc_cell_labels'.'''
+    # NOTE(JRC): Nonzero pixels are labelled as horizontal runs, which are
+    # found in each row of the mask with a single regular expression scan.
+    # Runs in adjacent rows that touch (including diagonally) are joined in a
+    # first pass, and components are numbered in a second pass.
+    mask_width, mask_height = mask_size
+    run_pattern = re.compile(b'[^\x00]+')
+
+    runs, row_runs = [], []
+    for row in range(mask_height):
+        row_offset = row * mask_width
+        row_runs.append(len(runs))
+        runs.extend(m.span() for m in
+            run_pattern.finditer(mask_bytes, row_offset, row_offset + mask_width))
+    row_runs.append(len(runs))
+
+    run_sets = dsets(len(runs))
+    for row in range(1, mask_height):
+        prev_index, prev_end = row_runs[row - 1], row_runs[row]
+        for run_index in range(row_runs[row], row_runs[row + 1]):
+            run_start, run_end = (r - mask_width for r in runs[run_index])
+            while prev_index < prev_end and runs[prev_index][1] < run_start:
+                prev_index += 1
+            adj_index = prev_index
+            while adj_index < prev_end and runs[adj_index][0] <= run_end:
+                run_sets.union(run_index, adj_index)
+                adj_index += 1
+            if adj_index > prev_index: prev_index = adj_index - 1
+
+    comp_labels, comps = {}, []
+    label_map = array.array('H' if len(runs) < 2**16 else 'L', [0]) * (mask_width * mask_height)
+    for run_index, (run_start, run_end) in enumerate(runs):
+        run_comp = run_sets.find(run_index)
+        if run_comp not in comp_labels:
+            comp_labels[run_comp] = len(comps) + 1
+            comps.append([])
+        run_label = comp_labels[run_comp]
+
+        comps[run_label - 1].extend(range(run_start, run_end))
+        label_map[run_start:run_end] = array.array(label_map.typecode,
+            [run_label]) * (run_end - run_start)
+
+    return comps, label_map
+
+def _calc_cell_strokes_dfs(image, boundaries):
+    '''NOTE(JRC): The original recursive implementation of 'calc_cell_strokes',
+    which is kept as a reference for benchmarks. It requires boundaries to be
+    listed in the traversal order of 'calc_connected_components'.'''
     # TODO(JRC): Change this method to be an iterative method so that this
     # weird adjustment of the recursion limit isn't necessary.
     sys.setrecursionlimit(5000)
@@ -230,61 +387,36 @@ def calc_cell_strokes(image, boundaries):
 
     return strokes
 
-def orient_cell_strokes(image, orient_image, strokes):
-    assert image.size == orient_image.size, 'The given image sizes do not match.'
-
-    oriented_strokes = []
-
-    stroke_orient_pixels = [
-        next((p for p in s if is_opaque(p, orient_image)), None)
-        for s in strokes]
-
-    # TODO(JRC): Add a check here that ensures that all of the non-opaque
-    # pixels are used in the given 'orient_image'.
-
-    for stroke, orient_pixel in zip(strokes, stroke_orient_pixels):
-        oriented_stroke = stroke
-        if orient_pixel:
-            orient_index = stroke.index(orient_pixel)
-            for shift_index, shift_value in \
-                    enumerate(stroke[orient_index:] + stroke[:orient_index]):
-                oriented_stroke[shift_index] = shift_value
-
-            orient_alpha = orient_image.getpixel(to_2d(orient_pixel, orient_image))[3]
-            want_orient = spa.orient.cw if orient_alpha == 255 else spa.orient.ccw
-            curr_orient = calc_orientation(oriented_stroke, image)
-            if curr_orient != want_orient : oriented_stroke.reverse()
-        oriented_strokes.append(oriented_stroke)
-
-    return oriented_strokes
-
-def order_cell_strokes(image, orient_image, strokes):
-    # TODO(JRC): There are still bugs in this code when grouping the pixels
-    # into bins.
-    assert image.size == orient_image.size, 'The given image sizes do not match.'
-
-    stroke_orient_pixels = [
-        next((p for p in s if is_opaque(p, orient_image)), None)
-        for s in strokes]
-
-    # TODO(JRC): Add a check here that ensures that all of the non-opaque
-    # pixels are used in the given 'orient_image'.
-
-    orient_color_to_strokes = collections.defaultdict(list)
-    orient_extra_strokes = []
-    for stroke, orient_pixel in zip(strokes, stroke_orient_pixels):
-        if orient_pixel:
-            orient_color = orient_image.getpixel(to_2d(orient_pixel, orient_image))[:3]
-            orient_color_to_strokes[orient_color].append(stroke)
+def _trace_boundary(boundary, image):
+    # NOTE(JRC): Boundaries are traced with Moore neighbour tracing, which walks
+    # clockwise around the boundary from its first pixel in scanline order
+    # (whose west neighbour is never in the boundary) and stops once it leaves
+    # this pixel in the same direction a second time (Jacob's criterion).
+    boundary_set = set(boundary)
+    start_pixel = min(boundary_set)
+    grid = calc_grid(image)
+    is_member = lambda x, y: grid.contains(x, y) and x + y * grid.width in boundary_set
+
+    stroke = [start_pixel]
+    start_x, start_y = curr_x, curr_y = to_2d(start_pixel, grid)
+    back_dir, first_dir = 0, None
+    while True:
+        for dir_step in range(1, 9):
+            next_dir = (back_dir + dir_step) % 8
+            next_dx, next_dy = _moore_offsets[next_dir]
+            if is_member(curr_x + next_dx, curr_y + next_dy): break
         else:
-            orient_extra_strokes.append(stroke)
+            return stroke
 
-    # TODO(JRC): Improve this behavior if default binning missing strokes
-    # becomes important in the future.
-    orient_color_to_strokes[orient_color_to_strokes.keys()[0]].extend(orient_extra_strokes)
+        if (curr_x, curr_y) == (start_x, start_y):
+            if first_dir is None: first_dir = next_dir
+            elif next_dir == first_dir: break
 
-    ordered_strokes = [orient_color_to_strokes[c] for c in
-        sorted(orient_color_to_strokes.keys(),
-        key=lambda c: colorsys.rgb_to_hsv(*c)[::-1] if c else (1.0, 1.0, 1.0))]
+        # NOTE(JRC): The next search starts from the last pixel checked before
+        # the next pixel, expressed as a direction from the next pixel.
+        back_dx, back_dy = _moore_offsets[(next_dir - 1) % 8]
+        back_dir = _moore_offsets.index((back_dx - next_dx, back_dy - next_dy))
+        curr_x, curr_y = curr_x + next_dx, curr_y + next_dy
+        stroke.append(curr_x + curr_y * grid.width)
 
-    return ordered_strokes
+    return stroke[:-1]
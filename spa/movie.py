@@ -1,7 +1,16 @@
 __doc__ = '''Module for the Movie Class Implementation'''
 
-import os, sys, math, shutil, inspect
-import spa, ffmpeg
+import os, sys, math, shutil, inspect, itertools, collections
+import multiprocessing, multiprocessing.pool
+from PIL import Image
+import spa, ffmpeg, rcache, frames
+
+### Module Setup ###
+
+# NOTE(JRC): Sequence functions are generally lambdas, which can't be sent to
+# worker processes, so all movies being rendered are registered here before
+# the worker processes are forked and then referenced by identifier.
+_render_movies = {}
 
 ### Module Classes ###
 
@@ -19,11 +28,15 @@ class movie(object):
         self._sequences.insert(index, (seq_func, duration))
         self._filters.insert(index, [])
 
-    # TODO(JRC): For the time being, a filter 'window' can only be specified
-    # in terms of percentage through the sequence (e.g. (0.0, 1.0) for the
-    # whole sequence); eventually, support for more options may be desirable.
-    def add_filter(self, filt_func, window, index=-1, subindex=-1):
-        self._filters[index].insert(subindex, (filt_func, window))
+    # NOTE(JRC): A filter 'window' is given either in terms of percentage
+    # through the sequence (e.g. (0.0, 1.0) for the whole sequence) or, if
+    # 'is_timed' is set, in terms of seconds from the start of the sequence.
+    # Filters with a 'radius' of zero are given each frame in their window and
+    # filters with a nonzero radius are given the list of frames within that
+    # many frames of each frame in their window; both return the new frame.
+    def add_filter(self, filt_func, window, index=-1, subindex=-1,
+            radius=0, is_timed=False):
+        self._filters[index].insert(subindex, (filt_func, window, radius, is_timed))
 
     def rem_sequence(self, index=-1):
         self._sequences.pop(index)
@@ -33,97 +46,417 @@ class movie(object):
         self._filters[index].pop(subindex)
 
     def render(self, file_path, data_path=None, fps=60,
-            encoding=ffmpeg.encoding.mp4, quality=0):
-        ll = spa.level_logger('movie.render')
+            encoding=ffmpeg.encoding.mp4, quality=0, stream=False, workers=1,
+            threads=1, cache=None, span=None, sequences=None, profile='default',
+            preview=None, preview_fps=24):
+        render_args = {'data_path': data_path, 'fps': fps, 'encoding': encoding,
+            'quality': quality, 'stream': stream, 'threads': threads,
+            'span': span, 'sequences': sequences, 'profile': profile,
+            'preview': preview, 'preview_fps': preview_fps}
+        return movie.render_batch([(self, file_path, render_args)],
+            workers=workers, cache=cache)[0]
+
+    @staticmethod
+    def render_batch(renders, workers=1, cache=None, progress=None):
+        '''NOTE(JRC): Renders each movie in the given list of (movie, file path,
+        render arguments) items, where the render arguments are those given to
+        'render' other than 'workers' and 'cache'. The sequences of all of the
+        movies are scheduled together on a single pool of worker processes, and
+        each movie is encoded as soon as all of its sequences are rendered.
+        If given, the 'progress' function is called with the fraction of the
+        work that's complete after each step. Returns a list of whether each
+        movie was rendered successfully.'''
+        render_jobs = [_render_job(m, fp, cache=cache, **ra) for m, fp, ra in renders]
+        render_results = [False for j in render_jobs]
+
+        # NOTE(JRC): The sequences of all movies are flattened into one list
+        # of tasks so that the sequences of one movie can be rendered while
+        # another movie's dependent sequences wait for their dependencies.
+        task_jobs = [(ji, si) for ji, j in enumerate(render_jobs) for si in range(j.num_sequences)]
+        task_offsets = [sum(j.num_sequences for j in render_jobs[:ji])
+            for ji in range(len(render_jobs))]
+        task_deps = [set(task_offsets[ji] + d for d in render_jobs[ji].seq_deps[si])
+            for ji, si in task_jobs]
+        tasks = set(task_offsets[ji] + si for ji, j in enumerate(render_jobs)
+            if j.is_valid for si in j.seq_tasks)
+        get_task = lambda t: render_jobs[task_jobs[t][0]].get_task(task_jobs[t][1])
+
+        # NOTE(JRC): Progress is measured in steps, where each rendered sequence
+        # and each encoded movie counts as a single step.
+        num_steps = len(tasks) + sum(1 for j in render_jobs if j.is_valid)
+        step_counter = itertools.count(1)
+        report_step = lambda: progress and progress(next(step_counter) / float(num_steps))
+
+        for render_movie, _, _ in renders: _render_movies[id(render_movie)] = render_movie
+        try:
+            for task, (task_result, task_paths) in _schedule(task_deps, get_task, workers, tasks=tasks):
+                spa.loaded_paths.update(task_paths)
+                job_index, seq_index = task_jobs[task]
+                report_step()
+                if render_jobs[job_index].add_result(seq_index, task_result):
+                    render_results[job_index] = render_jobs[job_index].finish()
+                    report_step()
+        finally:
+            for render_movie, _, _ in renders: _render_movies.pop(id(render_movie), None)
+
+        if cache is not None: cache.evict()
+
+        return render_results
+
+    ### Helpers ###
+
+    def _get_seq_type(self, index):
+        sequence = self._sequences[index][0]
+        return len(inspect.getargspec(sequence).args)
+
+    def _get_seq_deps(self, index):
+        adj_offsets = [-1] if self._get_seq_type(index) == 1 else [-1, 1]
+        return set(index+o for o in adj_offsets if
+            0 <= index+o < len(self._sequences) and self._get_seq_type(index+o) == 1)
+
+    def _render_sequence(self, index, path, args, seams, fps, stream, threads=1,
+            cache=None, preview=None):
+        seq_func, seq_duration = self._sequences[index]
+
+        # NOTE(JRC): A sequence is identified by everything that can affect
+        # its frames, which includes the values of all variables referenced
+        # by its functions and the boundary frames given by its neighbours.
+        # Sequences are always encoded losslessly, so the encoding settings
+        # of the movie don't affect them.
+        if cache is not None:
+            seq_key = rcache.digest(seq_func, seq_duration, self._filters[index],
+                args, seams, fps, ffmpeg.intermediate, preview)
+            seq_bounds = cache.get(seq_key, path)
+            if seq_bounds is not None: return seq_bounds
+
+        seq_bounds = self._render_frames(index, path, args, seams, fps, stream,
+            threads, preview)
+        if cache is not None and path is not None: cache.put(seq_key, path, seq_bounds)
+
+        return seq_bounds
+
+    def _render_frames(self, index, path, args, seams, fps, stream, threads=1, preview=None):
+        seq_func, seq_duration = self._sequences[index]
+        seq_num_frames = int(math.ceil(fps * seq_duration))
+        seq_frames = seq_func(*args, num_frames=seq_num_frames)
+        seq_size = len(seq_frames) if hasattr(seq_frames, '__len__') else None
+
+        filt_pool = multiprocessing.pool.ThreadPool(threads) \
+            if threads > 1 and self._filters[index] else None
+        try:
+            seq_frames = self._filter_frames(index, seq_frames, fps, filt_pool, 2*threads)
+            return self._encode_frames(index, path, seq_frames, seq_size,
+                seams, fps, stream, preview)
+        finally:
+            if filt_pool is not None:
+                filt_pool.terminate()
+                filt_pool.join()
+
+    def _filter_frames(self, index, seq_frames, fps, pool=None, lookahead=1):
+        # NOTE(JRC): Each filter is a lazy stage in the frame pipeline, so
+        # filtered frames are produced as they're consumed by the encoder.
+        # Filters are run on threads instead of processes since sequences are
+        # rendered in daemonic processes, which cannot have child processes.
+        seq_func, seq_duration = self._sequences[index]
+        seq_num_frames = len(seq_frames) if hasattr(seq_frames, '__len__') else \
+            int(math.ceil(fps * seq_duration))
+
+        for filt_func, window, radius, is_timed in self._filters[index]:
+            frame_window = tuple(int(round(w*fps)) if is_timed else
+                int(w*seq_num_frames) for w in window)
+            seq_frames = _filter_stage(filt_func, seq_frames, frame_window, radius,
+                pool, lookahead)
+
+        return seq_frames
+
+    def _encode_frames(self, index, path, seq_frames, seq_size, seams, fps,
+            stream, preview=None):
+        seq_func, seq_duration = self._sequences[index]
+        seq_num_frames = int(math.ceil(fps * seq_duration))
+
+        # NOTE(JRC): Preview frames are generated at full size (so that scenes
+        # and their analyses behave as they do in full renders) and are only
+        # scaled down as they're encoded. The boundary frames aren't scaled
+        # since they're used to generate the frames of adjacent sequences.
+        seq_image_size = _get_preview_size(self._canvas.size, preview)
+        flatten = lambda f: _get_preview_image(frames.flatten(f), seq_image_size)
+
+        # NOTE(JRC): Identical consecutive frames are collapsed into held runs,
+        # which are encoded as single frames whenever possible. The boundary
+        # frames of the sequence are recorded before its seams are smoothed.
+        seq_bounds = []
+        seq_runs = frames.smooth(_get_bounded_runs(seq_frames, seq_bounds), *seams)
+
+        # NOTE(JRC): Sequences without a path are only needed for their
+        # boundary frames, so their frames are generated but not encoded.
+        if path is None:
+            for run in seq_runs: pass
+        elif not stream:
+            seq_tmpl = os.path.join(os.path.dirname(path), '{0}-%d.png'.format(
+                os.path.splitext(os.path.basename(path))[0]))
+
+            seq_holds = []
+            for run_index, (run_frame, run_count) in enumerate(seq_runs):
+                flatten(run_frame).save(seq_tmpl % run_index)
+                seq_holds.append(run_count)
+            seq_fps = sum(seq_holds) / float(seq_duration)
+
+            # NOTE(JRC): The final frame of a held run at the end of a sequence
+            # is repeated so that the run is shown for its full duration.
+            if seq_holds and seq_holds[-1] > 1:
+                shutil.copyfile(seq_tmpl % (len(seq_holds) - 1), seq_tmpl % len(seq_holds))
+                seq_holds[-1:] = [seq_holds[-1] - 1, 1]
+
+            ffmpeg.render(path, seq_tmpl, fps=seq_fps, holds=seq_holds, profile=None)
+        else:
+            # NOTE(JRC): The runs are streamed as they're generated, so the
+            # exact number of frames in a sequence is never known in advance.
+            # Sequences given as lists are streamed at the rate of their full
+            # lengths and retimed after the fact if their seams were smoothed;
+            # all others are streamed at the movie frame rate and retimed by
+            # holding their last frames or by rescaling their timestamps.
+            seq_fps = seq_size / float(seq_duration) if seq_size else fps
+            with ffmpeg.stream(path, seq_image_size, fps=seq_fps, profile=None) as seq_stream:
+                for run_frame, run_count in seq_runs:
+                    run_image = flatten(run_frame)
+                    seq_stream.write(run_image, run_count)
+                if not seq_size and 0 < seq_stream.frame_count < seq_num_frames:
+                    seq_stream.write(run_image, seq_num_frames - seq_stream.frame_count)
+
+            seq_target_count = seq_size or seq_num_frames
+            if (seq_size or seq_stream.frame_count > seq_num_frames) and \
+                    0 < seq_stream.frame_count != seq_target_count:
+                ffmpeg.retime(path, seq_target_count / float(seq_stream.frame_count))
+
+        return seq_bounds
+
+class _render_job(object):
+    '''NOTE(JRC): The state of a single movie render, which describes the
+    tasks needed to render the movie's sequences and encodes the movie once
+    the results of all of these tasks have been added.'''
+    ### Constructors ###
+
+    def __init__(self, movie, file_path, data_path=None, fps=60,
+            encoding=ffmpeg.encoding.mp4, quality=0, stream=False, threads=1,
+            cache=None, span=None, sequences=None, profile='default',
+            preview=None, preview_fps=24):
+        self._ll = ll = spa.level_logger('movie.render')
+        self._movie, self._file_path = movie, file_path
+        self._fps, self._encoding, self._quality = fps, encoding, quality
+        self._profile, self._preview = profile, preview
+        self._stream, self._threads, self._cache, self._span = stream, threads, cache, span
 
         ll.log('Creating Data Paths', 1)
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
-        data_path = data_path or os.path.join(spa.output_dir, file_name)
-        if not (spa.touch(file_path, is_dir=False, force=True) and
-                spa.touch(data_path, is_dir=True, force=True)):
-            return False
+        self._file_name = os.path.splitext(os.path.basename(file_path))[0]
+        self._data_path = data_path or os.path.join(spa.output_dir, self._file_name)
+        self.is_valid = spa.touch(file_path, is_dir=False, force=True) and \
+            spa.touch(self._data_path, is_dir=True, force=True)
 
         # NOTE(JRC): For the sake of robustness, a movie is simply rendered
         # as a single frame sequence of the canvas if no sequences are given.
-        if not self._sequences:
-            self.add_sequence(lambda pf, **k: [self._canvas.copy()], 0.1)
-
-        # NOTE(JRC): Processing one sequence type per loop allows the sequences
-        # to be processed before the transitions.
-        ll.log('Generating Sequences', 1)
-        seq_frame_lists = [[] for s in self._sequences]
-        for iter_seq_type in range(1, 3):
-            iter_seq_str = 'Sequence' if iter_seq_type == 1 else 'Transition'
-            ll.log('Processing %ss' % iter_seq_str, 2)
-            for seq_index, (seq_func, seq_duration) in enumerate(self._sequences):
-                adj_frames = []
-                for adj_index in [seq_index+o for o in [-1, 1]]:
-                    if not (0 <= adj_index < len(self._sequences)) or \
-                            not seq_frame_lists[adj_index] or \
-                            self._get_seq_type(adj_index) == 2:
-                        adj_frame = self._canvas
-                    else:
-                        frame_index = -1 if adj_index < seq_index else 0
-                        adj_frame = seq_frame_lists[adj_index][frame_index]
-                    adj_frames.append(adj_frame)
-
-                if self._get_seq_type(seq_index) == iter_seq_type:
-                    ll.log('Producing Frames for Sequence #%d' % (seq_index + 1), 3)
-                    seq_args = tuple(adj_frames)[:iter_seq_type]
-                    seq_kwargs = {'num_frames': int(math.ceil(fps * seq_duration))}
-                    seq_frame_lists[seq_index].extend(seq_func(*seq_args, **seq_kwargs))
-
-        ll.log('Applying Filters', 1)
-        for seq_index, (seq_frames, seq_filters) in enumerate(zip(seq_frame_lists, self._filters)):
-            for filt_index, (filt_func, window) in enumerate(seq_filters):
-                ll.log('Filtering Sequence #%d w/ Filter #%d' % (seq_index, filt_index), 2)
-                frame_window = tuple(int(m*len(seq_frames)) for m in window)
-                filt_frames = seq_frames[frame_window[0]:frame_window[1]]
-                new_frames = filt_func(filt_frames)
-
-        '''
-        # TODO(JRC): Fix a bug in this code that causes sequences with singular
-        # frames to be deleted when adjacent to sequences with duplicates.
-        ll.log('Smoothing Sequence Seams', 1)
-        for prev_frames, curr_frames in zip(seq_frame_lists, seq_frame_lists[1:]):
-            if prev_frames[-1].tobytes() == curr_frames[0].tobytes():
-                prev_frames.pop()
-        '''
+        if not movie._sequences:
+            movie.add_sequence(lambda pf, **k: [movie._canvas.copy()], 0.1)
 
-        ll.log('Rendering Movie', 1)
+        # NOTE(JRC): Previews only reduce the number of frames in each
+        # sequence, so the timing of the movie is unaffected by the cap.
+        if preview is not None: self._fps = min(fps, preview_fps)
+
+        # NOTE(JRC): If only part of the movie is requested (i.e. a span of
+        # time in seconds and/or a list of sequence indices), then only the
+        # sequences in that part are encoded; the sequences they depend on are
+        # still generated, but only to produce their boundary frames.
+        self.num_sequences = len(movie._sequences)
+        self.seq_deps = [movie._get_seq_deps(si) for si in range(self.num_sequences)]
+        self._seq_starts = [sum(d for f, d in movie._sequences[:si]) for si in range(self.num_sequences)]
+        self._seq_indices = set(range(self.num_sequences) if sequences is None else sequences)
+        assert all(0 <= si < self.num_sequences for si in self._seq_indices), \
+            'Cannot render sequences that are not in the movie.'
+        if span is not None:
+            self._seq_indices = set(si for si in self._seq_indices if
+                self._seq_starts[si] < span[1] and span[0] < self._seq_starts[si] + movie._sequences[si][1])
+        assert self._seq_indices, 'Cannot render a movie part that contains no sequences.'
+
+        self.seq_tasks, seq_queue = set(), list(self._seq_indices)
+        while seq_queue:
+            seq_index = seq_queue.pop()
+            if seq_index not in self.seq_tasks:
+                self.seq_tasks.add(seq_index)
+                seq_queue.extend(self.seq_deps[seq_index])
+
+        # NOTE(JRC): Only the boundary frames of each sequence are retained
+        # after it has been rendered since these are the only frames needed
+        # by adjacent sequences. Each sequence is scheduled as soon as all of
+        # the adjacent sequences whose boundary frames it needs are rendered.
+        ll.log('Rendering Sequences', 1)
+        self._seq_paths = [os.path.join(self._data_path, '{0}-{1}.{2}'.format(
+            self._file_name, si, ffmpeg.intermediate_ext))
+            for si in range(self.num_sequences)]
+        self._seq_bound_lists = [None for si in range(self.num_sequences)]
+        self._seq_pending = set(self.seq_tasks)
 
-        ll.log('Rendering Sequences', 2)
-        seq_paths = []
-        for seq_index, (_, duration) in enumerate(self._sequences):
-            ll.log('Rendering Sequence #%d' % (seq_index + 1), 3)
-            seq_path = os.path.join(data_path, '{0}-{1}.mp4'.format(file_name, seq_index))
-            seq_tmpl = os.path.join(data_path, '{0}-{1}-%d.png'.format(file_name, seq_index))
-            seq_fps = len(seq_frame_lists[seq_index]) / float(duration)
+    ### Methods ###
+
+    def get_task(self, seq_index):
+        seq_deps, seq_bound_lists = self.seq_deps, self._seq_bound_lists
+
+        adj_frames = []
+        for adj_index in [seq_index+o for o in [-1, 1]]:
+            if adj_index not in seq_deps[seq_index] or \
+                    not seq_bound_lists[adj_index]:
+                adj_frame = self._movie._canvas
+            else:
+                frame_index = -1 if adj_index < seq_index else 0
+                adj_frame = seq_bound_lists[adj_index][frame_index]
+            adj_frames.append(adj_frame)
+
+        # NOTE(JRC): Seams are only smoothed against the neighbours that
+        # are rendered before this sequence (i.e. its dependencies).
+        seq_seams = tuple(seq_bound_lists[ai][fi] if ai in seq_deps[seq_index] and
+            seq_bound_lists[ai] else None for ai, fi in [(seq_index-1, -1), (seq_index+1, 0)])
+        seq_args = tuple(adj_frames)[:self._movie._get_seq_type(seq_index)]
+        seq_path = self._seq_paths[seq_index] if seq_index in self._seq_indices else None
+        return _render_task, (id(self._movie), seq_index, seq_path, seq_args, seq_seams,
+            self._fps, self._stream, self._threads, self._cache, self._preview)
 
-            for frame_index, frame in enumerate(seq_frame_lists[seq_index]):
-                frame.save(os.path.join(data_path, seq_tmpl % frame_index))
+    def add_result(self, seq_index, seq_bounds):
+        self._ll.log('Rendered Sequence #%d' % (seq_index + 1), 2)
+        self._seq_bound_lists[seq_index] = seq_bounds
+        self._seq_pending.discard(seq_index)
+        return not self._seq_pending
 
-            ffmpeg.render(seq_path, seq_tmpl, fps=seq_fps, quality=quality)
-            seq_paths.append(seq_path)
+    def finish(self):
+        ll, seq_paths = self._ll, self._seq_paths
+        quality, profile = self._quality, self._profile
+        ll.log('Rendering Movie', 1)
 
-        movie_path = os.path.join(data_path, '{0}.mp4'.format(file_name))
-        temp_path = os.path.join(data_path, '.{0}.mp4'.format(file_name))
+        movie_indices = sorted(self._seq_indices)
+        movie_paths = [seq_paths[si] for si in movie_indices]
+        movie_durations = [self._movie._sequences[si][1] for si in movie_indices]
+        movie_span = None if self._span is None else tuple(max(s - self._seq_starts[movie_indices[0]], 0.0)
+            for s in self._span)
 
-        ll.log('Concatenating Sequences', 2)
-        shutil.copy2(seq_paths[0], movie_path)
-        for seq_index, seq_path in enumerate(seq_paths[1:]):
-            ll.log('Conatenating Sequence #%d' % (seq_index + 2), 3)
-            ffmpeg.concat(temp_path, movie_path, seq_path, quality=quality)
-            shutil.copy2(temp_path, movie_path)
-        shutil.copy2(movie_path, file_path)
+        # NOTE(JRC): The sequence movies are lossless intermediates, so the
+        # movie is joined, trimmed and encoded in its final format in a single
+        # pass, which is the only lossy encoding of its frames.
+        movie_ext = 'gif' if self._encoding == ffmpeg.encoding.gif else 'mp4'
+        movie_path = os.path.join(self._data_path, '{0}.{1}'.format(self._file_name, movie_ext))
 
-        ll.log('Encoding Sequence', 2)
-        ffmpeg.encode(file_path, encoding, fps=fps, quality=quality)
+        ll.log('Encoding Sequences', 2)
+        ffmpeg.concat(movie_path, *movie_paths, quality=quality, profile=profile,
+            durations=movie_durations, encoding=self._encoding,
+            fps=self._fps, span=movie_span)
+        shutil.copy2(movie_path, self._file_path)
 
         return True
 
-    ### Helpers ###
+### Helper Functions ###
 
-    def _get_seq_type(self, index):
-        sequence = self._sequences[index][0]
-        return len(inspect.getargspec(sequence).args)
+def _render_task(movie_id, *args):
+    # NOTE(JRC): The files loaded while rendering (e.g. the default stencils of
+    # effects) are reported with the result since tasks may run in worker
+    # processes, whose loaded files are otherwise unknown to the caller.
+    return _render_movies[movie_id]._render_sequence(*args), dict(spa.loaded_paths)
+
+def _filter_stage(filt_func, filt_frames, window, radius, pool=None, lookahead=1):
+    def filter_frame(frame_index, frame, frame_window):
+        if not window[0] <= frame_index < window[1]: return frame
+        return filt_func(frames.flatten(frame)) if radius == 0 else \
+            filt_func([frames.flatten(f) for f in frame_window])
+
+    frame_tasks = _get_windows(filt_frames, radius)
+    if pool is None:
+        for frame_task in frame_tasks:
+            yield filter_frame(*frame_task)
+    else:
+        # NOTE(JRC): Only a fixed number of frames are filtered ahead of the
+        # consumer, which bounds the number of frames held in memory.
+        frame_results = collections.deque()
+        for frame_task in frame_tasks:
+            frame_results.append(pool.apply_async(filter_frame, frame_task))
+            if len(frame_results) >= lookahead: yield frame_results.popleft().get()
+        while frame_results: yield frame_results.popleft().get()
+
+def _get_windows(seq_frames, radius):
+    '''NOTE(JRC): Yields the index of each frame in the given sequence along
+    with the frame and the list of frames within 'radius' frames of it, which
+    is padded with the sequence's boundary frames at its ends.'''
+    prev_frames, next_frames = collections.deque(maxlen=radius), collections.deque()
+    frame_iter = iter(seq_frames)
+    next_frames.extend(itertools.islice(frame_iter, radius + 1))
+
+    frame_index = 0
+    while next_frames:
+        frame = next_frames.popleft()
+        if radius == 0:
+            frame_window = [frame]
+        else:
+            window_prev, window_next = list(prev_frames), list(next_frames)
+            frame_window = [(window_prev or [frame])[0]] * (radius - len(window_prev)) + \
+                window_prev + [frame] + window_next + \
+                [(window_next or [frame])[-1]] * (radius - len(window_next))
+        yield frame_index, frame, frame_window
+
+        prev_frames.append(frame)
+        next_frames.extend(itertools.islice(frame_iter, 1))
+        frame_index += 1
+
+def _get_preview_size(size, preview=None):
+    # NOTE(JRC): Preview frames are scaled to even dimensions so that they
+    # can always be encoded.
+    if preview is None or preview == 1.0: return tuple(size)
+    return tuple(max(int(round(preview * d / 2.0)) * 2, 2) for d in size)
+
+def _get_preview_image(image, size):
+    return image if image.size == size else image.resize(size, resample=Image.NEAREST)
+
+def _get_bounded_runs(seq_frames, seq_bounds):
+    run = None
+    for run_index, run in enumerate(frames.collapse(seq_frames)):
+        if run_index == 0: seq_bounds.append(frames.flatten(run[0]))
+        yield run
+    if run is not None: seq_bounds.append(frames.flatten(run[0]))
+
+def _schedule(task_deps, get_task, workers=1, tasks=None):
+    '''NOTE(JRC): Runs all of the tasks in the given dependency list (i.e. a
+    list of sets of the task indices on which each task depends), or only the
+    given subset of its tasks, and yields each task index with its result as
+    it completes. Tasks are described by the 'get_task' function, which is
+    only called once all the dependencies of a task have been yielded.'''
+    pending_tasks = sorted(tasks) if tasks is not None else list(range(len(task_deps)))
+    running_tasks, done_tasks = {}, set()
+    task_pool = multiprocessing.Pool(workers) if workers > 1 else None
+
+    try:
+        while pending_tasks or running_tasks:
+            ready_tasks = [t for t in pending_tasks if task_deps[t] <= done_tasks]
+            assert ready_tasks or running_tasks, 'Cannot schedule cyclic task dependencies.'
+
+            if task_pool is None:
+                task = ready_tasks[0]
+                pending_tasks.remove(task)
+                task_func, task_args = get_task(task)
+                task_result = task_func(*task_args)
+
+                done_tasks.add(task)
+                yield task, task_result
+            else:
+                for task in ready_tasks:
+                    pending_tasks.remove(task)
+                    task_func, task_args = get_task(task)
+                    running_tasks[task] = task_pool.apply_async(task_func, task_args)
+
+                finished_tasks = [t for t, r in running_tasks.items() if r.ready()]
+                if not finished_tasks:
+                    min(running_tasks.items())[1].wait(0.05)
+                for task in sorted(finished_tasks):
+                    task_result = running_tasks.pop(task).get()
+
+                    done_tasks.add(task)
+                    yield task, task_result
+    except:
+        if task_pool is not None: task_pool.terminate()
+        raise
+    else:
+        if task_pool is not None: task_pool.close()
+    finally:
+        if task_pool is not None: task_pool.join()
@@ -0,0 +1,101 @@
+__doc__ = '''Module for the Pixel Grid Implementation'''
+
+### Module Classes ###
+
+class pxgrid(object):
+    '''NOTE(JRC): An indexed view of an image for pixel-level analysis, which
+    stores the RGBA data and alpha channel of the image in flat buffers and
+    finds the neighbours of pixels with precomputed offset tables. Pixels are
+    referenced by their 1D (i.e. scanline) indices throughout.'''
+    ### Class Setup ###
+
+    # NOTE(JRC): The offsets to the neighbours of a pixel are listed in the
+    # order that 'imp.calc_adjacent' has always listed them (by column, then
+    # by row), which some of the analysis functions depend upon.
+    offsets_2d = [(dx, dy) for dx in range(-1, 2) for dy in range(-1, 2) if dx or dy]
+
+    ### Constructors ###
+
+    def __init__(self, image):
+        self._image = image
+        self._width, self._height = image.size
+
+        rgba_image = image if image.mode == 'RGBA' else image.convert('RGBA')
+        self._pixels = bytearray(rgba_image.tobytes())
+        self._alphas = self._pixels[3::4]
+
+        # NOTE(JRC): Each pixel has a border class with a bit set for each
+        # image edge it lies on (left, right, top, bottom), and each class has
+        # a table with the offsets of the neighbours that are in the image.
+        self._offsets = [dx + dy * self._width for dx, dy in pxgrid.offsets_2d]
+        self._border_offsets = [
+            [o for o, (dx, dy) in zip(self._offsets, pxgrid.offsets_2d) if not (
+                (bc & 1 and dx < 0) or (bc & 2 and dx > 0) or
+                (bc & 4 and dy < 0) or (bc & 8 and dy > 0))]
+            for bc in range(16)]
+        self._col_classes = bytearray(
+            int(x == 0) | int(x == self._width - 1) << 1 for x in range(self._width))
+        self._row_classes = bytearray(
+            int(y == 0) << 2 | int(y == self._height - 1) << 3 for y in range(self._height))
+
+    ### Operators ###
+
+    def __len__(self):
+        return self._width * self._height
+
+    ### Properties ###
+
+    @property
+    def image(self):
+        return self._image
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def height(self):
+        return self._height
+
+    @property
+    def size(self):
+        return (self._width, self._height)
+
+    @property
+    def pixels(self):
+        return self._pixels
+
+    @property
+    def alphas(self):
+        return self._alphas
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    ### Methods ###
+
+    def alpha(self, pixel):
+        return self._alphas[pixel]
+
+    def color(self, pixel):
+        return tuple(self._pixels[4 * pixel:4 * pixel + 4])
+
+    def is_opaque(self, pixel):
+        return self._alphas[pixel] != 0
+
+    def contains(self, x, y):
+        return 0 <= x < self._width and 0 <= y < self._height
+
+    def adjacent(self, pixel):
+        pixel_y, pixel_x = divmod(pixel, self._width)
+        border_class = self._col_classes[pixel_x] | self._row_classes[pixel_y]
+        return [pixel + o for o in self._border_offsets[border_class]]
+
+    def to_1d(self, pixels):
+        width = self._width
+        return [px + py * width for px, py in pixels]
+
+    def to_2d(self, pixels):
+        width = self._width
+        return [(p % width, p // width) for p in pixels]
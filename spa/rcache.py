@@ -0,0 +1,183 @@
+__doc__ = '''Module for the Render Cache Implementation'''
+
+import os, sys, glob, shutil, hashlib, types, weakref
+import spa
+from PIL import Image
+
+### Module Functions ###
+
+def digest(*values):
+    hasher = hashlib.sha1()
+    for value in values:
+        _update_digest(hasher, value, set())
+    return hasher.hexdigest()
+
+### Module Classes ###
+
+class rcache(object):
+    ### Constructors ###
+
+    def __init__(self, path=None, max_size=2**30):
+        self._path = path or spa.cache_dir
+        self._max_size = max_size
+
+    ### Methods ###
+
+    def get(self, key, seq_path):
+        entry_path = os.path.join(self._path, key)
+        if not os.path.isdir(entry_path): return None
+
+        # NOTE(JRC): The entry may be evicted by another render between the
+        # existence check and the copy, which is treated as a cache miss. If
+        # no segment path is given, then only the boundary frames are loaded.
+        try:
+            if seq_path is not None:
+                shutil.copyfile(os.path.join(entry_path, 'segment'), seq_path)
+            seq_bounds = []
+            for bound_path in sorted(glob.glob(os.path.join(entry_path, 'bound-*.png'))):
+                bound_image = Image.open(bound_path)
+                bound_image.load()
+                seq_bounds.append(bound_image)
+            os.utime(entry_path, None)
+        except (IOError, OSError):
+            return None
+
+        return seq_bounds
+
+    def put(self, key, seq_path, seq_bounds):
+        entry_path = os.path.join(self._path, key)
+        temp_path = os.path.join(self._path, '.{0}-{1}'.format(key, os.getpid()))
+        if os.path.isdir(entry_path) or not spa.touch(temp_path, is_dir=True, force=True):
+            return False
+
+        # NOTE(JRC): Entries are assembled in a private directory and then
+        # renamed into place, which guarantees that concurrent renders only
+        # ever observe complete entries.
+        try:
+            shutil.copyfile(seq_path, os.path.join(temp_path, 'segment'))
+            for bound_index, bound_image in enumerate(seq_bounds):
+                bound_image.save(os.path.join(temp_path, 'bound-{0}.png'.format(bound_index)))
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            return False
+        finally:
+            if os.path.isdir(temp_path): shutil.rmtree(temp_path, ignore_errors=True)
+
+        return True
+
+    def evict(self):
+        entry_paths = [p for p in glob.glob(os.path.join(self._path, '*')) if os.path.isdir(p)]
+        entry_sizes = {p: _get_size(p) for p in entry_paths}
+
+        cache_size = sum(entry_sizes.values())
+        for entry_path in sorted(entry_paths, key=lambda p: os.path.getmtime(p)):
+            if cache_size <= self._max_size: break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            cache_size -= entry_sizes[entry_path]
+
+    def clear(self):
+        spa.touch(self._path, is_dir=True, force=True)
+
+### Helper Functions ###
+
+def _get_size(path):
+    return sum(os.path.getsize(os.path.join(d, f))
+        for d, _, fs in os.walk(path) for f in fs)
+
+def _get_lib_digest():
+    if _get_lib_digest.value is None:
+        hasher = hashlib.sha1()
+        for lib_path in sorted(glob.glob(os.path.join(spa.base_dir, 'spa', '*.py'))):
+            with open(lib_path, 'rb') as lib_file:
+                hasher.update(lib_file.read())
+        _get_lib_digest.value = hasher.hexdigest()
+    return _get_lib_digest.value
+_get_lib_digest.value = None
+
+def _get_image_digest(image):
+    '''NOTE(JRC): Image digests are memoized per image object since large
+    images (e.g. stencils) are often referenced by many sequences. This assumes
+    that the images referenced by sequences aren't modified in place.'''
+    image_ref, image_digest = _get_image_digest.memo.get(id(image), (None, None))
+    if image_ref is None or image_ref() is not image:
+        hasher = hashlib.sha1()
+        hasher.update('{0}{1}'.format(image.mode, image.size))
+        if image.mode == 'P': hasher.update(repr(image.getpalette()))
+        hasher.update(image.tobytes())
+
+        image_digest = hasher.hexdigest()
+        _get_image_digest.memo[id(image)] = (weakref.ref(image), image_digest)
+    return image_digest
+_get_image_digest.memo = {}
+
+def _get_cell_contents(cell):
+    # NOTE(JRC): Closure cells are empty if their variables haven't been
+    # assigned yet (e.g. variables assigned after their closures are created),
+    # which are all hashed as the same placeholder value.
+    try:
+        return cell.cell_contents
+    except ValueError:
+        return _get_cell_contents.empty
+_get_cell_contents.empty = type('EmptyCell', (), {})()
+
+def _update_digest(hasher, value, visited):
+    '''NOTE(JRC): Updates the given hasher with a stable representation of the
+    given value. Functions are represented by their code and all of the values
+    they reference (i.e. defaults, closure cells and globals), and modules are
+    represented by their names, except for the 'spa' library, whose source is
+    hashed so that library changes invalidate all results.'''
+    # NOTE(JRC): Images are identified only by their contents so that images
+    # loaded from files match equivalent images generated in memory.
+    hasher.update('Image' if isinstance(value, Image.Image) else type(value).__name__)
+
+    if isinstance(value, (types.FunctionType, types.CodeType, types.MethodType)) or \
+            hasattr(value, '__dict__') and not isinstance(value, (type, types.ModuleType)):
+        if id(value) in visited: return
+        visited.add(id(value))
+
+    if value is None or isinstance(value, (bool, int, long, float, complex, basestring)):
+        hasher.update(repr(value))
+    elif isinstance(value, (tuple, list)):
+        hasher.update(str(len(value)))
+        for item in value: _update_digest(hasher, item, visited)
+    elif isinstance(value, dict):
+        hasher.update(str(len(value)))
+        for item_key in sorted(value.keys(), key=repr):
+            _update_digest(hasher, item_key, visited)
+            _update_digest(hasher, value[item_key], visited)
+    elif isinstance(value, (set, frozenset)):
+        hasher.update(''.join(sorted(digest(item) for item in value)))
+    elif isinstance(value, Image.Image):
+        hasher.update(_get_image_digest(value))
+    elif isinstance(value, types.FunctionType):
+        _update_digest(hasher, value.__code__, visited)
+        _update_digest(hasher, value.__defaults__, visited)
+        _update_digest(hasher, [_get_cell_contents(c) for c in (value.__closure__ or ())], visited)
+
+        func_names = set()
+        func_codes = [value.__code__]
+        while func_codes:
+            func_code = func_codes.pop()
+            func_names.update(func_code.co_names)
+            func_codes.extend(c for c in func_code.co_consts if isinstance(c, types.CodeType))
+        for func_name in sorted(func_names):
+            if func_name in value.__globals__:
+                hasher.update(func_name)
+                _update_digest(hasher, value.__globals__[func_name], visited)
+    elif isinstance(value, types.CodeType):
+        hasher.update(value.co_code)
+        _update_digest(hasher, value.co_consts, visited)
+        _update_digest(hasher, value.co_names, visited)
+    elif isinstance(value, types.MethodType):
+        _update_digest(hasher, value.__func__, visited)
+        _update_digest(hasher, value.__self__, visited)
+    elif isinstance(value, types.ModuleType):
+        hasher.update(value.__name__)
+        if value.__name__.split('.')[0] == 'spa': hasher.update(_get_lib_digest())
+    elif isinstance(value, (type, types.BuiltinFunctionType)):
+        hasher.update('{0}.{1}'.format(getattr(value, '__module__', ''), value.__name__))
+    elif hasattr(value, '__dict__'):
+        hasher.update(type(value).__module__ + type(value).__name__)
+        _update_digest(hasher, vars(value), visited)
+    else:
+        hasher.update(repr(value))
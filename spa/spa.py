@@ -1,6 +1,6 @@
 __doc__ = '''Module for SPA ((Sequential Picture Amalgamator)) Globals'''
 
-import os, sys, shutil, logging, collections, time, json, subprocess
+import os, sys, shutil, logging, collections, time, subprocess
 from PIL import Image
 
 ### Module Setup ###
@@ -8,12 +8,27 @@ from PIL import Image
 log = logging.getLogger('spa')
 log.addHandler(logging.NullHandler())
 
+# NOTE(JRC): The preview settings are kept in a mutable container so that
+# changes made through the 'spa' package are seen by all of its modules.
+preview = {'enabled': False, 'scale': 0.5, 'fps': 24}
+
+# NOTE(JRC): The modification time of each file loaded through 'load' is
+# recorded here at the time that it's loaded so that changes can be watched.
+loaded_paths = {}
+
+# NOTE(JRC): Decoded images are shared between all of the uses of the same
+# file in a process (e.g. by the scripts in a batch), so these images must be
+# treated as read-only by all of their users.
+loaded_images = {}
+
 ### Module Constants ###
 
 base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 input_dir = os.path.join(base_dir, 'in')
 output_dir = os.path.join(base_dir, 'out')
 temp_dir = os.path.join(base_dir, 'tmp')
+cache_dir = os.path.join(output_dir, 'cache')
+analysis_dir = os.path.join(output_dir, 'analysis')
 stencil_dir = os.path.join(input_dir, 'stencils')
 test_dir = os.path.join(input_dir, 'tests')
 
@@ -74,7 +89,21 @@ def load(image_name, image_type=imtype.input):
         imtype.stencil: stencil_dir,
         imtype.test: test_dir}
 
-    return Image.open(os.path.join(type_to_dir[image_type], image_name))
+    image_path = os.path.realpath(os.path.join(type_to_dir[image_type], image_name))
+    loaded_paths[image_path] = os.path.getmtime(image_path)
+
+    image_key = loaded_paths[image_path]
+    if loaded_images.get(image_path, (None, None))[0] != image_key:
+        image = Image.open(image_path)
+        image.load()
+        loaded_images[image_path] = (image_key, image)
+
+    # NOTE(JRC): Only the decoding of each image is shared between callers;
+    # each caller gets its own copy so that images can be drawn upon freely.
+    return loaded_images[image_path][1].copy()
+
+def resample(method):
+    return Image.NEAREST if preview['enabled'] else method
 
 def touch(path, is_dir=False, force=False):
     path_dir = os.path.realpath(path)
@@ -108,35 +137,6 @@ def touch(path, is_dir=False, force=False):
 
     return touch_succeeded
 
-# TODO(JRC): Write a function that colorizes cache files so that they're
-# easier to debug.
-def cache(cache_id):
-    def cache_decorator(func):
-        def cache_func(image, *args, **kwargs):
-            if not hasattr(image, 'filename'): return func(image, *args)
-
-            image_filename = os.path.basename(image.filename)
-            image_name = os.path.splitext(image_filename)[0]
-            cache_path = os.path.join(output_dir,
-                '{0}_{1}.json'.format(image_name, cache_id))
-
-            # If the cache file exists and has been modified more recently
-            # than the source image file, then use the cached result.
-            if os.path.isfile(cache_path) and \
-                    os.path.getmtime(image.filename) < os.path.getmtime(cache_path):
-                with open(cache_path, 'r') as cache_file:
-                    result = json.load(cache_file)
-                return result
-            else:
-                result = func(image, *args, **kwargs)
-                touch(cache_path, is_dir=False, force=False)
-                with open(cache_path, 'w') as cache_file:
-                    json.dump(result, cache_file)
-                return result
-
-        return cache_func
-    return cache_decorator
-
 ### Module Classes ###
 
 class color(tuple):
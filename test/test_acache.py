@@ -0,0 +1,113 @@
+__doc__ = '''Test Cases for the Analysis Cache Implementation'''
+
+import os, sys, shutil, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import spa
+from spa.acache import _pack, _unpack, entry_header
+
+### Test Classes ###
+
+class acache_test(unittest.TestCase):
+    ### Test Setup ###
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    ### Tests ###
+
+    def test_pack_arrays(self):
+        # NOTE(JRC): Nested lists of integers of any (uniform) depth are packed
+        # as arrays, with the smallest type that holds all of their integers.
+        for value in [[], [[]], [0, 255], [[1, 2, 3], [], [4]], [[[0, 70000], []], [[-5]]],
+                [[2**31, 3]], [[-2**31], [2**31 - 1]]]:
+            value_data = _pack(value)
+            self.assertEqual(entry_header.unpack_from(value_data)[1], b'a')
+            self.assertEqual(_unpack(value_data), value)
+
+        self.assertLess(len(_pack(list(range(256)))), len(_pack(list(range(257)))))
+
+    def test_pack_marshal(self):
+        # NOTE(JRC): All other values (including lists of mixed depths and of
+        # integers too large for arrays) fall back to the 'marshal' format.
+        for value in [{'cells': [1, 2]}, (1, 2), 'text', 1.5, None, [1.5, 2],
+                [[1], [[2]]], [1, [2]], [2**70], [[1], 'text']]:
+            value_data = _pack(value)
+            self.assertEqual(entry_header.unpack_from(value_data)[1], b'm')
+            self.assertEqual(_unpack(value_data), value)
+
+    def test_store_round_trip(self):
+        cache_values = {'a' * 40: [[1, 2], [3]], 'b' * 40: {'strokes': (1, 2)}}
+        put_cache = spa.acache(self.temp_dir)
+        for cache_key, cache_value in cache_values.items():
+            self.assertTrue(put_cache.put(cache_key, cache_value))
+
+        # NOTE(JRC): A new cache has nothing in memory, so it reads its
+        # results from the entries on disk.
+        get_cache = spa.acache(self.temp_dir)
+        for cache_key, cache_value in cache_values.items():
+            self.assertEqual(get_cache.get(cache_key), cache_value)
+        self.assertIsNone(get_cache.get('c' * 40))
+
+    def test_invalid_entries(self):
+        cache_key = 'a' * 40
+        spa.acache(self.temp_dir).put(cache_key, list(range(64)))
+
+        cache_path = os.path.join(self.temp_dir, cache_key)
+        with open(cache_path, 'rb') as cache_file:
+            cache_data = cache_file.read()
+        for invalid_data in [cache_data[:-1], cache_data[:3], b'XXXX' + cache_data[4:]]:
+            with open(cache_path, 'wb') as cache_file:
+                cache_file.write(invalid_data)
+            self.assertIsNone(spa.acache(self.temp_dir).get(cache_key))
+
+    def test_disk_eviction(self):
+        # NOTE(JRC): The cache is only large enough for two of these entries,
+        # so each new entry evicts the least recently used one, which is set
+        # explicitly since file times may not be precise enough to order them.
+        entry_value = list(range(100))
+        cache = spa.acache(self.temp_dir, max_size=2 * len(_pack(entry_value)))
+        cache_keys = [c * 40 for c in 'abcd']
+        entry_time = lambda k: os.path.getmtime(os.path.join(self.temp_dir, k))
+        set_time = lambda k, t: os.utime(os.path.join(self.temp_dir, k), (t, t))
+
+        cache.put(cache_keys[0], entry_value)
+        set_time(cache_keys[0], 1000)
+        cache.put(cache_keys[1], entry_value)
+        set_time(cache_keys[1], 2000)
+        cache.put(cache_keys[2], entry_value)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), cache_keys[1:3])
+
+        # NOTE(JRC): Reading an entry marks it as recently used.
+        set_time(cache_keys[2], 3000)
+        self.assertEqual(spa.acache(self.temp_dir).get(cache_keys[1]), entry_value)
+        self.assertGreater(entry_time(cache_keys[1]), entry_time(cache_keys[2]))
+        cache.put(cache_keys[3], entry_value)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), [cache_keys[1], cache_keys[3]])
+
+    def test_memory_eviction(self):
+        # NOTE(JRC): Results that are evicted from memory are read from disk,
+        # so they're missing only once their entries are removed as well.
+        entry_value = list(range(100))
+        cache = spa.acache(self.temp_dir, max_memory=len(_pack(entry_value)) * 3 // 2)
+        cache_keys = [c * 40 for c in 'ab']
+        for cache_key in cache_keys:
+            cache.put(cache_key, entry_value)
+            os.remove(os.path.join(self.temp_dir, cache_key))
+
+        self.assertIsNone(cache.get(cache_keys[0]))
+        self.assertEqual(cache.get(cache_keys[1]), entry_value)
+
+    def test_clear(self):
+        cache = spa.acache(self.temp_dir)
+        cache.put('a' * 40, [1])
+        cache.clear()
+        self.assertIsNone(cache.get('a' * 40))
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+### Main Entry Point ###
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+__doc__ = '''Test Cases for the Render Daemon Implementation'''
+
+import os, sys, time, errno, socket, struct, shutil, tempfile, subprocess
+import multiprocessing, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import spa
+from spa.daemon import request
+
+### Test Classes ###
+
+class daemon_test(unittest.TestCase):
+    '''NOTE(JRC): These tests run a daemon with simple test jobs (see
+    '_prepare_test_job') in a separate process, except for the tests of the
+    command line interface, which run "spa.py" itself as a daemon.'''
+    ### Test Setup ###
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, 'spa.sock')
+
+        self.daemon_process = multiprocessing.Process(target=_serve_test_jobs,
+            args=(self.socket_path,))
+        self.daemon_process.start()
+        _wait_for(lambda: os.path.exists(self.socket_path))
+
+    def tearDown(self):
+        if self.daemon_process.is_alive():
+            try: request(self.socket_path, 'shutdown')
+            except socket.error: pass
+            self.daemon_process.join(5.0)
+        if self.daemon_process.is_alive():
+            self.daemon_process.terminate()
+            self.daemon_process.join()
+        shutil.rmtree(self.temp_dir)
+
+    ### Tests ###
+
+    def test_submit_and_status(self):
+        job_id = request(self.socket_path, 'submit', args=['quick'])['id']
+        self.assertTrue(_wait_for(lambda: self._get_state(job_id) == 'done'))
+
+        job_status = request(self.socket_path, 'status', id=job_id)
+        self.assertTrue(job_status['ok'])
+        self.assertEqual(job_status['progress'], 1.0)
+        self.assertEqual(job_status['args'], ['quick'])
+        self.assertEqual([j['id'] for j in request(self.socket_path, 'status')['jobs']], [job_id])
+        self.assertFalse(request(self.socket_path, 'status', id=job_id + 1)['ok'])
+
+    def test_cancel_queued_job(self):
+        # NOTE(JRC): Only one job runs at a time, so the second job waits in
+        # the queue behind the first one until it's cancelled.
+        run_id = request(self.socket_path, 'submit', args=['sleep', self.temp_dir])['id']
+        wait_id = request(self.socket_path, 'submit', args=['quick'])['id']
+        self.assertEqual(request(self.socket_path, 'cancel', id=wait_id)['state'], 'cancelled')
+        self.assertEqual(request(self.socket_path, 'cancel', id=run_id)['state'], 'cancelled')
+        self.assertEqual(self._get_state(wait_id), 'cancelled')
+
+    def test_cancel_running_job(self):
+        # NOTE(JRC): Running jobs are stopped along with all of the processes
+        # they've started (e.g. "ffmpeg"), which share their process group.
+        job_id = request(self.socket_path, 'submit', args=['sleep', self.temp_dir])['id']
+        pid_path = os.path.join(self.temp_dir, 'pids')
+        self.assertTrue(_wait_for(lambda: os.path.exists(pid_path)))
+        with open(pid_path, 'r') as pid_file:
+            job_pids = [int(p) for p in pid_file.read().split()]
+        self.assertEqual(request(self.socket_path, 'status', id=job_id)['progress'], 0.5)
+
+        self.assertEqual(request(self.socket_path, 'cancel', id=job_id)['state'], 'cancelled')
+        self.assertTrue(_wait_for(lambda: not any(_is_running(p) for p in job_pids)))
+        self.assertEqual(self._get_state(job_id), 'cancelled')
+
+    def test_failed_jobs(self):
+        fail_id = request(self.socket_path, 'submit', args=['fail'])['id']
+        error_id = request(self.socket_path, 'submit', args=['error'])['id']
+        self.assertTrue(_wait_for(lambda: self._get_state(error_id) == 'failed'))
+
+        self.assertEqual(self._get_state(fail_id), 'failed')
+        self.assertIn('Invalid test job', request(self.socket_path, 'status', id=fail_id)['error'])
+        self.assertIn('RuntimeError', request(self.socket_path, 'status', id=error_id)['error'])
+
+    def test_invalid_requests(self):
+        self.assertFalse(request(self.socket_path, 'bogus')['ok'])
+
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client_socket.connect(self.socket_path)
+        client_socket.sendall('not json\n')
+        self.assertIn('Invalid request', client_socket.recv(4096))
+        client_socket.close()
+
+    def test_client_disconnect(self):
+        # NOTE(JRC): Clients are reset both before they've sent full requests
+        # and before they've read their responses, neither of which may stop
+        # the daemon from serving other clients.
+        for client_request in ['{"command": "sta', '{"command": "status"}\n' * 64]:
+            client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                struct.pack('ii', 1, 0))
+            client_socket.connect(self.socket_path)
+            client_socket.sendall(client_request)
+            client_socket.close()
+
+        self.assertTrue(request(self.socket_path, 'status')['ok'])
+        self.assertTrue(self.daemon_process.is_alive())
+
+    def test_shutdown(self):
+        job_id = request(self.socket_path, 'submit', args=['sleep', self.temp_dir])['id']
+        pid_path = os.path.join(self.temp_dir, 'pids')
+        self.assertTrue(_wait_for(lambda: os.path.exists(pid_path)))
+        with open(pid_path, 'r') as pid_file:
+            job_pids = [int(p) for p in pid_file.read().split()]
+
+        self.assertTrue(request(self.socket_path, 'shutdown')['ok'])
+        self.daemon_process.join(5.0)
+        self.assertFalse(self.daemon_process.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertTrue(_wait_for(lambda: not any(_is_running(p) for p in job_pids)))
+
+    def test_command_line_daemon(self):
+        spa_path = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.realpath(__file__))), 'spa.py')
+        socket_path = os.path.join(self.temp_dir, 'spa-cli.sock')
+        with open(os.devnull, 'w') as null_file:
+            spa_process = subprocess.Popen([sys.executable, spa_path, '--daemon', socket_path],
+                stdout=null_file, stderr=null_file)
+        try:
+            self.assertTrue(_wait_for(lambda: os.path.exists(socket_path)))
+
+            job_id = request(socket_path, 'submit', args=['--bogus'])['id']
+            self.assertTrue(_wait_for(lambda: request(socket_path, 'status',
+                id=job_id)['state'] == 'failed'))
+            job_error = request(socket_path, 'status', id=job_id)['error']
+            self.assertIn('Invalid render job arguments "--bogus"', job_error)
+            self.assertIn('unrecognized arguments: --bogus', job_error)
+
+            self.assertTrue(request(socket_path, 'shutdown')['ok'])
+            self.assertTrue(_wait_for(lambda: spa_process.poll() is not None))
+            self.assertEqual(spa_process.returncode, 0)
+        finally:
+            if spa_process.poll() is None:
+                spa_process.kill()
+                spa_process.wait()
+
+    ### Helpers ###
+
+    def _get_state(self, job_id):
+        return request(self.socket_path, 'status', id=job_id)['state']
+
+### Helper Functions ###
+
+def _serve_test_jobs(socket_path):
+    spa.daemon(socket_path, _prepare_test_job).serve()
+
+def _prepare_test_job(job_args):
+    '''NOTE(JRC): Prepares one of the following test jobs: 'quick' (succeeds
+    immediately), 'fail' (has invalid arguments), 'error' (raises while
+    rendering) or 'sleep <dir>' (starts a child process, records the ids of
+    both processes in '<dir>/pids' and then waits to be stopped).'''
+    if job_args[0] == 'fail':
+        raise ValueError('Invalid test job.')
+
+    def run_job(progress):
+        progress(0.5)
+        if job_args[0] == 'error':
+            raise RuntimeError('Test job error.')
+        elif job_args[0] == 'sleep':
+            sleep_process = subprocess.Popen(['sleep', '60'])
+            pid_path = os.path.join(job_args[1], 'pids')
+            with open(pid_path + '.tmp', 'w') as pid_file:
+                pid_file.write('{0} {1}'.format(os.getpid(), sleep_process.pid))
+            os.rename(pid_path + '.tmp', pid_path)
+            time.sleep(60)
+        return True
+
+    return run_job
+
+def _is_running(pid):
+    # NOTE(JRC): Processes that have exited but haven't been reaped yet (i.e.
+    # zombies) are considered to be stopped.
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    try:
+        with open('/proc/{0}/stat'.format(pid), 'r') as stat_file:
+            return stat_file.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+def _wait_for(condition, timeout=10.0):
+    wait_end = time.time() + timeout
+    while not condition():
+        if time.time() > wait_end: return False
+        time.sleep(0.05)
+    return True
+
+### Main Entry Point ###
+
+if __name__ == '__main__':
+    unittest.main()
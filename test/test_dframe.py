@@ -0,0 +1,31 @@
+__doc__ = '''Test Cases for the Dirty Frame Implementation'''
+
+import os, sys, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import spa
+from PIL import Image
+
+### Test Classes ###
+
+class dcanvas_test(unittest.TestCase):
+    ### Tests ###
+
+    def test_clear_after_first_commit(self):
+        # NOTE(JRC): Regions that are drawn before the first commit must be
+        # patched away when they're cleared, so the first commit has to become
+        # the reference for all of the commits after it.
+        canvas = spa.dcanvas(Image.new('RGBA', (4, 4), color=(0, 0, 0, 255)))
+        canvas.paste(Image.new('RGBA', (2, 2), color=(255, 0, 0, 255)), (0, 0))
+        first_frame = canvas.commit()
+        canvas.clear()
+        second_frame = canvas.commit()
+
+        self.assertEqual(first_frame.image().getpixel((1, 1)), (255, 0, 0, 255))
+        self.assertEqual(canvas.image.getpixel((1, 1)), (0, 0, 0, 255))
+        self.assertEqual(second_frame.image().getpixel((1, 1)), (0, 0, 0, 255))
+        self.assertEqual(second_frame.image().tobytes(), canvas.image.tobytes())
+
+### Main Entry Point ###
+
+if __name__ == '__main__':
+    unittest.main()
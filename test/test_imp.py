@@ -0,0 +1,96 @@
+__doc__ = '''Test Cases for the Image Processing Functionality'''
+
+import os, sys, json, shutil, tempfile, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import spa
+from spa.acache import _get_cache
+from PIL import Image
+
+### Module Constants ###
+
+ref_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ref', 'imp.json')
+
+### Test Classes ###
+
+class imp_test(unittest.TestCase):
+    '''NOTE(JRC): The reference outputs of these tests were produced by the
+    original analysis functions on small test images (or crops of them), and
+    are listed with cells and boundaries ordered by their first pixels and
+    with all pixel lists in scanline order.'''
+    ### Test Setup ###
+
+    def setUp(self):
+        # NOTE(JRC): The analysis results are cached in a private directory
+        # so that the functions under test are always run.
+        self.temp_dir = tempfile.mkdtemp()
+        _get_cache.value = spa.acache(self.temp_dir)
+
+        with open(ref_path, 'r') as ref_file:
+            self.refs = json.load(ref_file)
+        for ref in self.refs:
+            ref_image = spa.load(ref['image'], spa.imtype.test)
+            ref['image'] = ref_image.crop(ref['box']) if ref['box'] else ref_image
+
+    def tearDown(self):
+        _get_cache.value = None
+        shutil.rmtree(self.temp_dir)
+
+    ### Tests ###
+
+    def test_opaque_cells(self):
+        for ref in self.refs:
+            self.assertEqual(spa.imp.calc_opaque_cells(ref['image']), ref['cells'])
+
+    def test_cell_boundaries(self):
+        # NOTE(JRC): The boundaries of each cell are ordered by their first
+        # pixels, which includes the boundaries of any holes in the cell.
+        for ref in self.refs:
+            self.assertEqual(spa.imp.calc_cell_boundaries(ref['image'], ref['cells']),
+                ref['boundaries'])
+
+    def test_trace_closed_boundaries(self):
+        # NOTE(JRC): The original tracer takes diagonal shortcuts past some of
+        # the corners of a boundary, so its strokes must follow the traced
+        # contour in the same order, skipping pixels, and must match it exactly
+        # when they don't skip any. Only closed contours (i.e. boundaries that
+        # are traced with each of their pixels once) are compared.
+        num_compared = 0
+        for ref in self.refs:
+            grid = spa.imp.calc_grid(ref['image'])
+            for boundary in (b for bl in ref['boundaries'] for b in bl):
+                trace_stroke = spa.imp._trace_boundary(boundary, ref['image'])
+                self.assertTrue(set(trace_stroke) <= set(boundary))
+                for stroke_index in range(len(trace_stroke)):
+                    self.assertIn(trace_stroke[stroke_index - 1],
+                        grid.adjacent(trace_stroke[stroke_index]))
+                if sorted(trace_stroke) != boundary: continue
+
+                dfs_boundary = spa.imp.calc_connected_components(ref['image'],
+                    set(boundary), lambda *a: True)[0]
+                try:
+                    dfs_stroke = spa.imp._calc_cell_strokes_dfs(ref['image'], [[dfs_boundary]])[0][0]
+                except AssertionError:
+                    continue
+
+                self.assertTrue(_follows_cycle(dfs_stroke, trace_stroke))
+                if len(dfs_stroke) == len(boundary):
+                    self.assertTrue(_follows_cycle(trace_stroke, dfs_stroke))
+                num_compared += 1
+        self.assertGreater(num_compared, 0)
+
+### Helper Functions ###
+
+def _follows_cycle(stroke, cycle):
+    '''NOTE(JRC): Returns true if all the pixels of the given stroke appear in
+    the given cyclic list of pixels in the same order (in either direction).'''
+    for cycle_dir in [cycle, cycle[::-1]]:
+        if stroke[0] not in cycle_dir: return False
+        cycle_start = cycle_dir.index(stroke[0])
+        cycle_iter = iter(cycle_dir[cycle_start:] + cycle_dir[:cycle_start])
+        if all(p in cycle_iter for p in stroke): return True
+    return False
+
+### Main Entry Point ###
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+__doc__ = '''Test Cases for the Movie Class Implementation'''
+
+import os, sys, shutil, tempfile, unittest, distutils.spawn
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import spa
+from PIL import Image
+
+### Test Classes ###
+
+@unittest.skipIf(distutils.spawn.find_executable('ffmpeg') is None,
+    'Movies cannot be rendered without "ffmpeg".')
+class movie_test(unittest.TestCase):
+    ### Test Setup ###
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    ### Tests ###
+
+    def test_preview_stroke_render(self):
+        # NOTE(JRC): The stroke effects analyze their input images, so preview
+        # renders must leave these images at their full sizes.
+        base_image = spa.load('test3_cells.png', spa.imtype.test)
+        stroke_image = spa.load('test3_strokes.png', spa.imtype.test)
+        out_image = Image.new('RGBA', base_image.size, color=spa.colorize('white'))
+
+        test_movie = spa.movie(out_image)
+        test_movie.add_sequence(lambda pf, **k: spa.fx.sstroke(pf, base_image,
+            stroke_image=stroke_image, stencil=spa.colorize('black'), **k), 0.5)
+
+        for stream in [False, True]:
+            test_path = os.path.join(self.temp_dir, 'preview-{0:d}.mp4'.format(stream))
+            self.assertTrue(test_movie.render(test_path,
+                data_path=os.path.join(self.temp_dir, 'preview-{0:d}'.format(stream)),
+                stream=stream, preview=0.25, preview_fps=12))
+            self.assertGreater(os.path.getsize(test_path), 0)
+
+### Main Entry Point ###
+
+if __name__ == '__main__':
+    unittest.main()
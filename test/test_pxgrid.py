@@ -0,0 +1,62 @@
+__doc__ = '''Test Cases for the Pixel Grid Implementation'''
+
+import os, sys, unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import spa
+from PIL import Image
+
+### Test Classes ###
+
+class pxgrid_test(unittest.TestCase):
+    '''NOTE(JRC): The neighbours of each pixel are listed by column and then
+    by row (i.e. (-1, -1), (-1, 0), (-1, 1), (0, -1), ...), which the analysis
+    functions rely upon, with all of the neighbours outside the image removed.
+    The expected neighbours below are the scanline indices of the pixels in a
+    4x3 image (i.e. 0-3 on the top row and 8-11 on the bottom row).'''
+    ### Test Setup ###
+
+    def setUp(self):
+        self.grid = spa.pxgrid(Image.new('RGBA', (4, 3)))
+
+    ### Tests ###
+
+    def test_interior_neighbours(self):
+        self.assertEqual(self.grid.adjacent(5), [0, 4, 8, 1, 9, 2, 6, 10])
+        self.assertEqual(self.grid.adjacent(6), [1, 5, 9, 2, 10, 3, 7, 11])
+
+    def test_corner_neighbours(self):
+        self.assertEqual(self.grid.adjacent(0), [4, 1, 5])
+        self.assertEqual(self.grid.adjacent(3), [2, 6, 7])
+        self.assertEqual(self.grid.adjacent(8), [4, 5, 9])
+        self.assertEqual(self.grid.adjacent(11), [6, 10, 7])
+
+    def test_border_neighbours(self):
+        self.assertEqual(self.grid.adjacent(1), [0, 4, 5, 2, 6])
+        self.assertEqual(self.grid.adjacent(10), [5, 9, 6, 7, 11])
+        self.assertEqual(self.grid.adjacent(4), [0, 8, 1, 5, 9])
+        self.assertEqual(self.grid.adjacent(7), [2, 6, 10, 3, 11])
+
+    def test_thin_neighbours(self):
+        # NOTE(JRC): Pixels in images that are one pixel wide or tall lie on
+        # both of the opposite borders of their images.
+        self.assertEqual(spa.pxgrid(Image.new('RGBA', (1, 3))).adjacent(1), [0, 2])
+        self.assertEqual(spa.pxgrid(Image.new('RGBA', (3, 1))).adjacent(1), [0, 2])
+        self.assertEqual(spa.pxgrid(Image.new('RGBA', (1, 1))).adjacent(0), [])
+
+    def test_original_neighbours(self):
+        # NOTE(JRC): This is the original 'imp.calc_adjacent' implementation,
+        # which the grid neighbours must match for images of all shapes.
+        def calc_adjacent(pixel, width, height):
+            px, py = pixel % width, pixel // width
+            return [(px+dx) + (py+dy) * width for dx in range(-1, 2) for dy in range(-1, 2)
+                if 0 <= px+dx < width and 0 <= py+dy < height and (dx or dy)]
+
+        for size in [(4, 3), (3, 4), (2, 2), (1, 4), (4, 1), (5, 5)]:
+            grid = spa.pxgrid(Image.new('RGBA', size))
+            for pixel in range(len(grid)):
+                self.assertEqual(grid.adjacent(pixel), calc_adjacent(pixel, *size))
+
+### Main Entry Point ###
+
+if __name__ == '__main__':
+    unittest.main()